@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from boto3_utils import AwsS3Helper, AwsEmrHelper
+
+class _AsyncHelper:
+    '''
+        Base class running the blocking methods of a wrapped helper on a thread pool, with at most max_concurrency
+        calls in flight. Attributes and methods that aren't overridden are taken from the wrapped helper.
+    '''
+
+    def __init__(self, helper, max_concurrency):
+        self.helper = helper
+        self.max_concurrency = max_concurrency
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        self._semaphore = None
+
+    def __getattr__(self, name):
+        return getattr(self.helper, name)
+
+    async def _run(self, func, *args, **kwargs):
+        # Created on first use so that it belongs to the running event loop.
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self._semaphore:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    async def _iter_batches(self, items, batch_size):
+        '''
+            Async generator over the items of a blocking generator, pulled in batches of batch_size on the thread pool
+            so the event loop isn't blocked while they are produced.
+        '''
+        def next_batch():
+            batch = []
+            for item in items:
+                batch.append(item)
+                if len(batch) == batch_size: break
+            return batch
+
+        try:
+            while True:
+                batch = await self._run(next_batch)
+                for item in batch:
+                    yield item
+                if len(batch) < batch_size: break
+        finally:
+            await self._run(items.close)
+
+    def close(self):
+        '''
+            Function to shut down the helper's thread pool once all pending calls are done.
+        '''
+        self.executor.shutdown(wait=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
+
+class AsyncAwsS3Helper(_AsyncHelper):
+
+    def __init__(self,AWS_ACCESS_KEY_ID,AWS_SECRET_ACCESS_KEY,region_name="ap-southeast-1",max_concurrency=50):
+        '''
+            asyncio version of AwsS3Helper. Every method of AwsS3Helper that calls S3 is a coroutine here, taking the
+            same parameters. Calls run on a thread pool sharing AwsS3Helper's pooled client, and at most
+            max_concurrency of them run at a time, so hundreds of operations can be awaited together.
+
+            PARAMETERS:
+                AWS_ACCESS_KEY_ID (string): Access Key associated with an AWS account.
+                AWS_SECRET_ACCESS_KEY (string): Corresponding Secret Key associated to the account.
+                (OPTIONAL) region_name (string): Region for the account. Set default to 'ap-southeast-1'.
+                (OPTIONAL) max_concurrency (int): number of calls run at a time. Default is 50.
+
+            USAGE:
+                async with AsyncAwsS3Helper(AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY) as conn_s3:
+                    await asyncio.gather(*[conn_s3.upload_file('s3_bucket/s3_path/' + f, '/home/abc/' + f) for f in fnames])
+        '''
+        _AsyncHelper.__init__(self, AwsS3Helper(AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, region_name=region_name,
+                                                max_pool_connections=max_concurrency), max_concurrency)
+
+    async def upload_file(self, path, inpfname):
+        return await self._run(self.helper.upload_file, path, inpfname)
+
+    async def download_file(self, path, outfname):
+        return await self._run(self.helper.download_file, path, outfname)
+
+    async def upload_stream(self, path, iterable, **kwargs):
+        return await self._run(self.helper.upload_stream, path, iterable, **kwargs)
+
+    async def upload_dir(self, s3_path, local_dir, **kwargs):
+        return await self._run(self.helper.upload_dir, s3_path, local_dir, **kwargs)
+
+    async def download_dir(self, s3_path, local_dir, **kwargs):
+        return await self._run(self.helper.download_dir, s3_path, local_dir, **kwargs)
+
+    async def sync(self, local_dir, s3_path, **kwargs):
+        return await self._run(self.helper.sync, local_dir, s3_path, **kwargs)
+
+    async def upload_changed(self, uploads, **kwargs):
+        return await self._run(self.helper.upload_changed, uploads, **kwargs)
+
+    async def del_file(self, path):
+        return await self._run(self.helper.del_file, path)
+
+    async def delete_keys(self, paths, **kwargs):
+        return await self._run(self.helper.delete_keys, paths, **kwargs)
+
+    async def delete_prefix(self, prefix_name, **kwargs):
+        return await self._run(self.helper.delete_prefix, prefix_name, **kwargs)
+
+    async def list_keys(self, prefix_name):
+        return await self._run(self.helper.list_keys, prefix_name)
+
+    async def iter_keys(self, prefix_name, batch_size=1000, **kwargs):
+        '''
+            Async generator version of AwsS3Helper.iter_keys. Entries are pulled from the listing in batches of
+            batch_size on the thread pool, so the event loop isn't blocked while pages are fetched.
+
+            USAGE:
+                async for entry in conn_s3.iter_keys('s3_bucket/s3_path/'):
+                    print(entry['path'])
+        '''
+        async for entry in self._iter_batches(self.helper.iter_keys(prefix_name, **kwargs), batch_size):
+            yield entry
+
+    async def iter_prefix_records(self, prefix_name, batch_size=1000, **kwargs):
+        '''
+            Async generator version of AwsS3Helper.iter_prefix_records, pulling records in batches of batch_size.
+
+            USAGE:
+                async for record in conn_s3.iter_prefix_records('s3_bucket/job_output/'):
+                    key, value = record.split('\\t', 1)
+        '''
+        async for record in self._iter_batches(self.helper.iter_prefix_records(prefix_name, **kwargs), batch_size):
+            yield record
+
+    async def copy_key(self, src_key, dst_key, **kwargs):
+        return await self._run(self.helper.copy_key, src_key, dst_key, **kwargs)
+
+    async def copy_prefix(self, src_prefix, dst_prefix, **kwargs):
+        return await self._run(self.helper.copy_prefix, src_prefix, dst_prefix, **kwargs)
+
+    async def compact_prefix(self, src_prefix, dst_prefix, **kwargs):
+        return await self._run(self.helper.compact_prefix, src_prefix, dst_prefix, **kwargs)
+
+    async def get_last_modified(self, path):
+        return await self._run(self.helper.get_last_modified, path)
+
+    async def stat_many(self, paths, **kwargs):
+        return await self._run(self.helper.stat_many, paths, **kwargs)
+
+class AsyncAwsEmrHelper(_AsyncHelper):
+
+    def __init__(self,AWS_ACCESS_KEY_ID,AWS_SECRET_ACCESS_KEY,region_name="ap-southeast-1",max_concurrency=50):
+        '''
+            asyncio version of AwsEmrHelper. Methods that call S3, EMR or the spot price feed are coroutines here,
+            taking the same parameters; the others (e.g. set_input_path, add_bootstrap_actions) are the plain methods
+            of the wrapped AwsEmrHelper. Like AwsEmrHelper, one helper should be used per job flow; helpers with the
+            same credentials share their clients.
+
+            PARAMETERS:
+                AWS_ACCESS_KEY_ID (string): Access Key associated with an AWS account.
+                AWS_SECRET_ACCESS_KEY (string): Corresponding Secret Key associated to the account.
+                (OPTIONAL) region_name (string): Region for the account. Set default to 'ap-southeast-1'.
+                (OPTIONAL) max_concurrency (int): number of calls run at a time. Default is 50.
+
+            USAGE:
+                conn_emr = AsyncAwsEmrHelper(AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY)
+                await conn_emr.add_job_step(step_name, input_path, output_path, mapper_path, mapper_fname)
+                await conn_emr.add_instance(instance_dict)
+                await conn_emr.run_job('My Job', 'emr-logs/', release_label='emr-5.0.0')
+                jobstate = await conn_emr.get_cluster_status()
+        '''
+        _AsyncHelper.__init__(self, AwsEmrHelper(AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, region_name=region_name,
+                                                 max_pool_connections=max_concurrency), max_concurrency)
+
+    async def get_spot_price(self, instance_dict):
+        return await self._run(self.helper.get_spot_price, instance_dict)
+
+    async def get_spot_prices(self):
+        return await self._run(self.helper.get_spot_prices)
+
+    async def clear_s3_folder(self, s3_path):
+        return await self._run(self.helper.clear_s3_folder, s3_path)
+
+    async def compact_input(self, input_path, compact_path, **kwargs):
+        return await self._run(self.helper.compact_input, input_path, compact_path, **kwargs)
+
+    async def set_output_path(self, output_path, del_existing_path):
+        return await self._run(self.helper.set_output_path, output_path, del_existing_path)
+
+    async def set_mapper_loc(self, mapper_loc, mapper_fname, **kwargs):
+        return await self._run(self.helper.set_mapper_loc, mapper_loc, mapper_fname, **kwargs)
+
+    async def set_reducer_loc(self, reducer_loc, reducer_fname, **kwargs):
+        return await self._run(self.helper.set_reducer_loc, reducer_loc, reducer_fname, **kwargs)
+
+    async def add_job_step(self, *args, **kwargs):
+        return await self._run(self.helper.add_job_step, *args, **kwargs)
+
+    async def get_step_inputs(self, **kwargs):
+        return await self._run(self.helper.get_step_inputs, **kwargs)
+
+    async def plan_instances(self, instance_dict, deadline, **kwargs):
+        return await self._run(self.helper.plan_instances, instance_dict, deadline, **kwargs)
+
+    async def add_instance(self, instance_dict, deadline=None, **kwargs):
+        return await self._run(self.helper.add_instance, instance_dict, deadline, **kwargs)
+
+    async def run_job(self, *args, **kwargs):
+        return await self._run(self.helper.run_job, *args, **kwargs)
+
+    async def get_pool_clusters(self, pool_key):
+        return await self._run(self.helper.get_pool_clusters, pool_key)
+
+    async def run_job_in_pool(self, *args, **kwargs):
+        return await self._run(self.helper.run_job_in_pool, *args, **kwargs)
+
+    async def scale_down_pool(self, pool_key, **kwargs):
+        return await self._run(self.helper.scale_down_pool, pool_key, **kwargs)
+
+    async def get_cluster_status(self):
+        return await self._run(self.helper.get_cluster_status)
+
+    async def iter_cluster_events(self, job_ids=None, **kwargs):
+        '''
+            Async generator version of AwsEmrHelper.iter_cluster_events. Events are pulled one at a time on the thread
+            pool, so each is yielded as soon as it is seen and the event loop isn't blocked between polls.
+
+            USAGE:
+                async for event in conn_emr.iter_cluster_events():
+                    print(event['job_id'], event['name'], event['state'])
+        '''
+        async for event in self._iter_batches(self.helper.iter_cluster_events(job_ids, **kwargs), 1):
+            yield event
+
+    async def wait_for_cluster(self, job_ids=None, callback=None, **kwargs):
+        return await self._run(self.helper.wait_for_cluster, job_ids, callback, **kwargs)
+
+    async def read_output(self, step=None, batch_size=1000, **kwargs):
+        '''
+            Async generator version of AwsEmrHelper.read_output, pulling records in batches of batch_size.
+
+            USAGE:
+                async for record in conn_emr.read_output('My Step'):
+                    print(record)
+        '''
+        async for record in self._iter_batches(self.helper.read_output(step, **kwargs), batch_size):
+            yield record
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Offline benchmarks for the hot paths of AwsS3Helper and AwsEmrHelper. S3 and EMR are replaced by moto's in-process
+stand-in (pip install moto), with a fixed latency injected in every API call, so results are comparable between
+versions of boto3_utils without an AWS account.
+
+Each benchmark reports operations and bytes per second and API calls made (by operation) from an untraced run, and
+peak Python memory from a second, traced run. The results are written as JSON:
+
+    python benchmark.py --keys 100000 --latency 5 --output bench.json
+"""
+
+import argparse
+import collections
+import contextlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+try:
+    import moto
+except ImportError:
+    sys.exit("moto is required to run the benchmarks: pip install moto")
+
+import boto3_utils
+from boto3_utils import AwsEmrHelper
+
+BUCKET = "boto3-utils-bench"
+REGION = "us-east-1"
+
+class ApiCounter:
+    '''
+        Counts API calls made through the clients it is attached to, sleeping latency seconds in each to stand in
+        for the network round trip.
+    '''
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = collections.Counter()
+        self.active = True
+
+    def attach(self, client):
+        client.meta.events.register("before-call", self.before_call)
+
+    @contextlib.contextmanager
+    def paused(self):
+        '''
+            Context manager in which calls are neither counted nor delayed, to set up benchmarks at full speed.
+        '''
+        self.active = False
+        try:
+            yield
+        finally:
+            self.active = True
+
+    def before_call(self, model, **kwargs):
+        if not self.active:
+            return
+        self.calls[model.name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+def run_benchmark(name, counter, func, ops, nbytes=0, setup=None):
+    '''
+        Function to time func and collect its API calls, then run it again under tracemalloc for its peak memory, so
+        that tracing doesn't slow down the timed run. setup, if given, is called before each run to restore the state
+        func expects (e.g. objects to delete), without injected latency.
+
+        OUTPUT:
+            A dict with the benchmark results.
+    '''
+    if setup:
+        with counter.paused():
+            setup()
+    counter.calls.clear()
+    start = time.time()
+    func()
+    seconds = time.time() - start
+    calls = dict(counter.calls)
+
+    if setup:
+        with counter.paused():
+            setup()
+    tracemalloc.start()
+    func()
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    result = {"name":name, "ops":ops, "seconds":round(seconds, 4), "ops_per_sec":round(ops/seconds, 2),
+              "bytes":nbytes, "bytes_per_sec":round(nbytes/seconds, 2), "api_calls":calls,
+              "peak_memory_bytes":peak_memory}
+    print("%-24s %10.1f ops/s %14.1f bytes/s %8d api calls" % (name, result["ops_per_sec"], result["bytes_per_sec"],
+                                                                sum(calls.values())), file=sys.stderr)
+    return result
+
+def populate(conn_s3, prefix, num_keys, body=b"x"):
+    '''
+        Function to create num_keys objects under prefix directly through the client, outside of any benchmark.
+    '''
+    for i in range(num_keys):
+        conn_s3.conn.put_object(Bucket=BUCKET, Key="%s/d%03d/part-%07d" % (prefix, i % 100, i), Body=body)
+
+def write_spot_feed(path):
+    '''
+        Function to write an offline copy of the spot price feed, in the JSONP format served at SPOT_PRICE_URL, with
+        prices for the feed's regions and a range of instance types.
+    '''
+    families = ["m3", "m4", "m5", "c3", "c4", "c5", "r3", "r4", "r5", "i3", "d2", "x1"]
+    sizes = ["large", "xlarge", "2xlarge", "4xlarge", "8xlarge", "16xlarge"]
+    regions = []
+    for i, region in enumerate(sorted(set(boto3_utils.SPOT_FEED_REGIONS.values()))):
+        instance_types = [{"type":family, "sizes":[{"size":"%s.%s" % (family, size),
+                                                   "valueColumns":[{"name":"linux", "prices":{"USD":"%.4f" % (0.01*(i + j + 1))}}]}
+                                                  for j, size in enumerate(sizes)]} for family in families]
+        regions.append({"region":region, "instanceTypes":instance_types})
+    with open(path, "w") as f:
+        f.write("callback(%s)" % json.dumps({"vers":0.01, "config":{"rate":"perhr", "valueColumns":["linux"],
+                                                                   "currencies":["USD"], "regions":regions}}))
+
+def benchmarks(args, workdir):
+    '''
+        Generator running each benchmark in turn and yielding its results.
+    '''
+    counter = ApiCounter(args.latency/1000.0)
+    conn_emr = AwsEmrHelper("bench", "bench", region_name=REGION)
+    conn_s3 = conn_emr.conn_s3
+    counter.attach(conn_s3.conn)
+    counter.attach(conn_emr.conn_emr)
+    with counter.paused():
+        conn_s3.conn.create_bucket(Bucket=BUCKET)
+        populate(conn_s3, "list", args.keys)
+    yield run_benchmark("list_keys", counter, lambda: conn_s3.list_keys(BUCKET + "/list/"), args.keys)
+    yield run_benchmark("iter_keys_parallel", counter,
+                        lambda: collections.deque(conn_s3.iter_keys(BUCKET + "/list/", parallel=True), maxlen=0), args.keys)
+    yield run_benchmark("clear_s3_folder", counter, lambda: conn_emr.clear_s3_folder(BUCKET + "/list/"), args.keys,
+                        setup=lambda: populate(conn_s3, "list", args.keys))
+
+    local_dir = os.path.join(workdir, "upload")
+    os.makedirs(local_dir)
+    body = os.urandom(args.file_size)
+    for i in range(args.files):
+        with open(os.path.join(local_dir, "part-%05d" % i), "wb") as f:
+            f.write(body)
+    nbytes = args.files*args.file_size
+    yield run_benchmark("upload_dir", counter, lambda: conn_s3.upload_dir(BUCKET + "/files/", local_dir), args.files, nbytes)
+    yield run_benchmark("download_dir", counter, lambda: conn_s3.download_dir(BUCKET + "/files/", os.path.join(workdir, "download")),
+                        args.files, nbytes)
+
+    with counter.paused():
+        conn_s3.upload_stream(BUCKET + "/big/object", (os.urandom(1024*1024) for _ in range(args.copy_mb)), part_size=8*1024*1024)
+    yield run_benchmark("copy_key_multipart", counter,
+                        lambda: conn_s3.copy_key(BUCKET + "/big/object", BUCKET + "/big/copy", multipart_threshold=16*1024*1024,
+                                                 part_size=8*1024*1024), 1, args.copy_mb*1024*1024)
+    yield run_benchmark("copy_prefix", counter, lambda: conn_s3.copy_prefix(BUCKET + "/files/", BUCKET + "/copied/"), args.files, nbytes)
+
+    conn_emr.manifest_path = os.path.join(workdir, "manifest.json")
+    mapper = os.path.join(workdir, "map.py")
+    with open(mapper, "w") as f:
+        f.write("import sys\n")
+    cache_files = [os.path.join(local_dir, fname) for fname in sorted(os.listdir(local_dir))]
+
+    def add_job_step():
+        conn_emr.add_job_step("bench", BUCKET + "/input/", BUCKET + "/output/", BUCKET + "/src/map.py", mapper,
+                              cache_files=cache_files, cache_loc=BUCKET + "/cache/")
+
+    def clear_artifacts():
+        if os.path.exists(conn_emr.manifest_path):
+            os.remove(conn_emr.manifest_path)
+        conn_s3.delete_prefix(BUCKET + "/src/")
+        conn_s3.delete_prefix(BUCKET + "/cache/")
+    yield run_benchmark("add_job_step_cold", counter, add_job_step, len(cache_files) + 1, nbytes, setup=clear_artifacts)
+    yield run_benchmark("add_job_step_cached", counter, add_job_step, len(cache_files) + 1, nbytes)
+
+    conn_emr.spot_price_source = os.path.join(workdir, "spot.js")
+    write_spot_feed(conn_emr.spot_price_source)
+    instances = {"MASTER":{"instance_type":"m3.xlarge","num_instances":1,"market":"SPOT","name":"Main Nodes"},
+                 "CORE":{"instance_type":"r3.xlarge","num_instances":2,"market":"SPOT","name":"Worker Nodes"}}
+
+    def add_instance():
+        for _ in range(args.clusters):
+            conn_emr.instance_list = []
+            conn_emr.add_instance(instances)
+    # Each run starts with an empty cache, so it includes reading, parsing and indexing the feed once.
+    yield run_benchmark("add_instance_spot", counter, add_instance, args.clusters, setup=boto3_utils._spot_price_cache.clear)
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks for boto3_utils.")
+    parser.add_argument("--keys", type=int, default=100000, help="number of keys listed and deleted")
+    parser.add_argument("--files", type=int, default=200, help="number of files uploaded, downloaded and copied")
+    parser.add_argument("--file-size", type=int, default=256*1024, help="size in bytes of each file")
+    parser.add_argument("--copy-mb", type=int, default=64, help="size in MB of the object copied with multipart copy")
+    parser.add_argument("--clusters", type=int, default=100, help="number of clusters configured with spot instances")
+    parser.add_argument("--latency", type=float, default=5, help="latency in milliseconds injected in every API call")
+    parser.add_argument("--output", help="path of the JSON results. Default is stdout.")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    try:
+        with moto.mock_aws():
+            results = {"version":1, "time":int(time.time()), "params":vars(args),
+                       "benchmarks":list(benchmarks(args, workdir))}
+    finally:
+        shutil.rmtree(workdir)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,870 @@
 #!/usr/bin/env python
 
-import boto3
 import time
 import os
-import requests
+import sys
 import json
+import threading
+import bisect
+import logging
+import socket
+import calendar
+import hashlib
+import io
+import zlib
+import bz2
+import heapq
+import tempfile
+import gzip
+import tarfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
+try:
+    from queue import Queue, Full
+except ImportError:
+    from Queue import Queue, Full
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_client(service, region_name, AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, max_pool_connections=50):
+    '''
+        Function to get a boto3 client shared by all helpers of the process. Clients are created once per service,
+        region, credentials and pool size, with adaptive retries and TCP keep-alive, and reused afterwards.
+
+        PARAMETERS:
+            service (string): AWS service name, e.g. 's3' or 'emr'.
+            region_name (string): Region for the account.
+            AWS_ACCESS_KEY_ID (string): Access Key associated with an AWS account.
+            AWS_SECRET_ACCESS_KEY (string): Corresponding Secret Key associated to the account.
+            (OPTIONAL) max_pool_connections (int): size of the client's connection pool. Default is 50.
+
+        OUTPUT:
+            boto3 client
+
+        USAGE:
+            conn = get_client('s3', 'ap-southeast-1', AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY)
+    '''
+    key = (service, region_name, AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, max_pool_connections)
+    with _clients_lock:
+        if key not in _clients:
+            # boto3 takes most of the import time of this module, so it's only imported once a client is needed.
+            import boto3
+            from botocore.config import Config
+            config = Config(max_pool_connections=max_pool_connections, retries={"mode":"adaptive", "max_attempts":10},
+                            tcp_keepalive=True)
+            session = boto3.session.Session(aws_access_key_id=AWS_ACCESS_KEY_ID, aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+                                            region_name=region_name)
+            _clients[key] = session.client(service, config=config)
+            if _stats is not None:
+                _register_handlers(_clients[key])
+            if service == "s3" and _rate_controller is not None:
+                _register_rate_handlers(_clients[key])
+        return _clients[key]
+
+THROTTLING_ERROR_CODES = ["SlowDown","Throttling","ThrottlingException","ThrottledException","RequestLimitExceeded",
+                          "TooManyRequestsException","RequestThrottled","RequestThrottledException","ProvisionedThroughputExceededException"]
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+_stats = None
+
+class ClientStats:
+    '''
+        Per-operation statistics of the API calls made by the helpers' clients, filled in by the botocore event
+        handlers registered by enable_instrumentation. For each (service, operation) it keeps the number of calls,
+        attempts (calls plus retries), errors and throttling errors, bytes sent and received, and a latency histogram.
+        Every call is also passed to the record method of each sink, and flush passes the stats to their flush method.
+    '''
+
+    def __init__(self, sinks=None):
+        self.sinks = list(sinks or [])
+        self.lock = threading.Lock()
+        self.operations = {}
+
+    def record(self, event):
+        '''
+            Function to add one API call to the stats. event is a dict with keys 'service', 'operation', 'latency'
+            (seconds), 'attempts', 'throttles', 'error' (error code, or None), 'bytes_sent' and 'bytes_received'.
+        '''
+        with self.lock:
+            op = self.operations.get((event["service"], event["operation"]))
+            if op is None:
+                op = {"calls":0, "attempts":0, "errors":0, "throttles":0, "bytes_sent":0, "bytes_received":0,
+                      "latency_sum":0.0, "latency_buckets":[0]*(len(LATENCY_BUCKETS) + 1)}
+                self.operations[(event["service"], event["operation"])] = op
+            op["calls"] += 1
+            op["attempts"] += event["attempts"]
+            op["errors"] += 1 if event["error"] else 0
+            op["throttles"] += event["throttles"]
+            op["bytes_sent"] += event["bytes_sent"]
+            op["bytes_received"] += event["bytes_received"]
+            op["latency_sum"] += event["latency"]
+            op["latency_buckets"][bisect.bisect_left(LATENCY_BUCKETS, event["latency"])] += 1
+        for sink in self.sinks:
+            sink.record(event)
+
+    def snapshot(self):
+        '''
+            Function to get a copy of the stats.
+
+            OUTPUT:
+                A dict mapping 'service.operation' to a dict with keys 'calls', 'attempts', 'retries', 'errors',
+                'throttles', 'bytes_sent', 'bytes_received', 'latency_sum' and 'latency_buckets' (a list of
+                (upper bound in seconds, number of calls) pairs, the last bound being None).
+        '''
+        with self.lock:
+            result = {}
+            for (service, operation), op in self.operations.items():
+                op = dict(op)
+                op["retries"] = op["attempts"] - op["calls"]
+                op["latency_buckets"] = list(zip(LATENCY_BUCKETS + [None], op["latency_buckets"]))
+                result[service + "." + operation] = op
+            return result
+
+    def reset(self):
+        with self.lock:
+            self.operations = {}
+
+    def to_prometheus(self, prefix="boto3_utils"):
+        '''
+            Function to get the stats in the Prometheus text exposition format.
+        '''
+        lines = []
+        snapshot = self.snapshot()
+        for name, field in [("calls","calls"), ("retries","retries"), ("errors","errors"), ("throttles","throttles"),
+                            ("sent_bytes","bytes_sent"), ("received_bytes","bytes_received")]:
+            lines.append("# TYPE %s_%s_total counter" % (prefix, name))
+            for key in sorted(snapshot):
+                service, operation = key.split(".", 1)
+                lines.append('%s_%s_total{service="%s",operation="%s"} %d' % (prefix, name, service, operation, snapshot[key][field]))
+        lines.append("# TYPE %s_latency_seconds histogram" % prefix)
+        for key in sorted(snapshot):
+            service, operation = key.split(".", 1)
+            labels = 'service="%s",operation="%s"' % (service, operation)
+            count = 0
+            for bound, num in snapshot[key]["latency_buckets"]:
+                count += num
+                le = "+Inf" if bound is None else repr(float(bound))
+                lines.append('%s_latency_seconds_bucket{%s,le="%s"} %d' % (prefix, labels, le, count))
+            lines.append("%s_latency_seconds_sum{%s} %f" % (prefix, labels, snapshot[key]["latency_sum"]))
+            lines.append("%s_latency_seconds_count{%s} %d" % (prefix, labels, count))
+        return "\n".join(lines) + "\n"
+
+    def flush(self):
+        '''
+            Function to pass the stats to the flush method of each sink.
+        '''
+        for sink in self.sinks:
+            sink.flush(self)
+
+class LoggingSink:
+    '''
+        Sink logging every API call at DEBUG level, and a summary per operation at INFO level on flush.
+    '''
+
+    def __init__(self, logger=None):
+        self.logger = logger or logging.getLogger("boto3_utils")
+
+    def record(self, event):
+        self.logger.debug("%s.%s took %.3fs in %d attempts%s", event["service"], event["operation"], event["latency"],
+                          event["attempts"], ", error " + event["error"] if event["error"] else "")
+
+    def flush(self, stats):
+        snapshot = stats.snapshot()
+        for key in sorted(snapshot):
+            op = snapshot[key]
+            self.logger.info("%s: %d calls, %d retries, %d errors, %d throttles, %d bytes sent, %d bytes received, %.3fs mean latency",
+                             key, op["calls"], op["retries"], op["errors"], op["throttles"], op["bytes_sent"],
+                             op["bytes_received"], op["latency_sum"]/max(op["calls"], 1))
+
+class StatsdSink:
+    '''
+        Sink sending every API call to a StatsD server over UDP, as a timer and counters named
+        prefix.service.operation.*.
+    '''
+
+    def __init__(self, host="localhost", port=8125, prefix="boto3_utils"):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def record(self, event):
+        name = "%s.%s.%s" % (self.prefix, event["service"], event["operation"])
+        metrics = ["%s.latency:%d|ms" % (name, int(event["latency"]*1000)), "%s.calls:1|c" % name]
+        if event["attempts"] > 1:
+            metrics.append("%s.retries:%d|c" % (name, event["attempts"] - 1))
+        if event["error"]:
+            metrics.append("%s.errors:1|c" % name)
+        if event["throttles"]:
+            metrics.append("%s.throttles:%d|c" % (name, event["throttles"]))
+        if event["bytes_sent"]:
+            metrics.append("%s.bytes_sent:%d|c" % (name, event["bytes_sent"]))
+        if event["bytes_received"]:
+            metrics.append("%s.bytes_received:%d|c" % (name, event["bytes_received"]))
+        try:
+            self.socket.sendto("\n".join(metrics).encode("utf-8"), self.address)
+        except (IOError, OSError):
+            pass
+
+    def flush(self, stats):
+        pass
+
+class PrometheusFileSink:
+    '''
+        Sink writing the stats in the Prometheus text format to a file on flush, e.g. for node_exporter's textfile
+        collector.
+    '''
+
+    def __init__(self, path, prefix="boto3_utils"):
+        self.path = path
+        self.prefix = prefix
+
+    def record(self, event):
+        pass
+
+    def flush(self, stats):
+        _save_text(self.path, stats.to_prometheus(self.prefix))
+
+def _body_size(body):
+    '''
+        Utility function to get the size of a request body (bytes or file-like object), or 0 if unknown.
+    '''
+    if body is None:
+        return 0
+    try:
+        return len(body)
+    except TypeError:
+        pass
+    try:
+        position = body.tell()
+        body.seek(0, os.SEEK_END)
+        size = body.tell() - position
+        body.seek(position)
+        return size
+    except (AttributeError, IOError, OSError):
+        return 0
+
+def _is_throttled(response):
+    '''
+        Utility function to tell whether a (http_response, parsed) response, as passed to needs-retry handlers, is a
+        throttling error.
+    '''
+    if response is None:
+        return False
+    http_response, parsed = response
+    return parsed.get("Error", {}).get("Code") in THROTTLING_ERROR_CODES or http_response.status_code in [429, 503]
+
+def _on_before_call(model, params, context, **kwargs):
+    context["boto3_utils_call"] = {"service":model.service_model.endpoint_prefix, "operation":model.name, "start":time.time(),
+                                   "attempts":0, "throttles":0, "bytes_sent":_body_size(params.get("body"))}
+
+def _on_needs_retry(response, request_dict, **kwargs):
+    call = request_dict.get("context", {}).get("boto3_utils_call")
+    if call is None:
+        return
+    call["attempts"] += 1
+    if _is_throttled(response):
+        call["throttles"] += 1
+
+def _on_after_call(context, parsed=None, exception=None, **kwargs):
+    call = context.pop("boto3_utils_call", None)
+    stats = _stats
+    if call is None or stats is None:
+        return
+    if exception is not None:
+        error = type(exception).__name__
+    else:
+        error = parsed.get("Error", {}).get("Code") if parsed else None
+    bytes_received = parsed.get("ContentLength", 0) if parsed and "Body" in parsed else 0
+    stats.record({"service":call["service"], "operation":call["operation"], "latency":time.time() - call["start"],
+                  "attempts":max(call["attempts"], 1), "throttles":call["throttles"], "error":error,
+                  "bytes_sent":call["bytes_sent"], "bytes_received":bytes_received})
+
+_HANDLERS = [("before-call", _on_before_call), ("needs-retry", _on_needs_retry), ("after-call", _on_after_call),
+             ("after-call-error", _on_after_call)]
+
+def _register_handlers(client):
+    for event, handler in _HANDLERS:
+        client.meta.events.register(event, handler, unique_id="boto3_utils-" + event)
+
+def enable_instrumentation(stats=None):
+    '''
+        Function to start collecting stats of the API calls made by all clients from get_client, i.e. by all helpers.
+        Handlers are registered on botocore's event system only while instrumentation is enabled, so there is no
+        overhead otherwise.
+
+        PARAMETERS:
+            (OPTIONAL) stats (ClientStats): stats object to fill in, e.g. with sinks. Default is a new ClientStats.
+
+        OUTPUT:
+            The ClientStats object being filled in.
+
+        USAGE:
+            stats = enable_instrumentation(ClientStats(sinks=[LoggingSink(), StatsdSink('statsd.local')]))
+            ...
+            stats.flush()
+    '''
+    global _stats
+    with _clients_lock:
+        _stats = stats or ClientStats()
+        for client in _clients.values():
+            _register_handlers(client)
+    return _stats
+
+def disable_instrumentation():
+    '''
+        Function to stop collecting stats and unregister the event handlers from all clients.
+    '''
+    global _stats
+    with _clients_lock:
+        _stats = None
+        for client in _clients.values():
+            for event, handler in _HANDLERS:
+                client.meta.events.unregister(event, handler, unique_id="boto3_utils-" + event)
+
+def get_stats():
+    '''
+        Function to get the ClientStats being filled in, or None if instrumentation is disabled.
+    '''
+    return _stats
+
+class RateController:
+    '''
+        Adaptive client-side rate limiter of S3 requests, shared by all helpers through the event handlers registered
+        on their S3 clients (see enable_rate_limiting). S3 scales request rates per prefix, so reads (Get, Head, List)
+        and writes are limited separately for each bucket and prefix, i.e. the first prefix_depth folders of the key.
+
+        Each limit is a token bucket allowing bursts of burst requests. It starts at S3's documented per-prefix rates,
+        is multiplied by decrease (at most once every decrease_interval seconds) when S3 answers with SlowDown, 503 or
+        another throttling error, and grows back by about increase requests per second every second while requests
+        succeed. DeleteObjects calls take one token per key deleted.
+    '''
+
+    def __init__(self, max_read_rate=5500, max_write_rate=3500, min_rate=1, increase=50, decrease=0.5, decrease_interval=1,
+                 burst=10, prefix_depth=1):
+        self.max_read_rate = max_read_rate
+        self.max_write_rate = max_write_rate
+        self.min_rate = min_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.decrease_interval = decrease_interval
+        self.burst = burst
+        self.prefix_depth = prefix_depth
+        self.lock = threading.Lock()
+        self.limits = {}
+
+    def get_key(self, bucket, key, write):
+        '''
+            Function to get the key of the limit applied to requests on a s3 key (or listing prefix) of a bucket.
+
+            OUTPUT:
+                A tuple (bucket/prefix, 'read' or 'write').
+        '''
+        prefix = "/".join(key.split("/")[:-1][:self.prefix_depth])
+        return bucket + "/" + prefix, "write" if write else "read"
+
+    def _limit(self, limit_key):
+        limit = self.limits.get(limit_key)
+        if limit is None:
+            rate = self.max_write_rate if limit_key[1] == "write" else self.max_read_rate
+            limit = self.limits[limit_key] = {"rate":float(rate), "next_time":0.0, "last_decrease":0.0, "throttles":0}
+        return limit
+
+    def acquire(self, limit_key, tokens=1):
+        '''
+            Function to wait until tokens requests can be sent under a limit.
+        '''
+        with self.lock:
+            limit = self._limit(limit_key)
+            now = time.time()
+            interval = 1.0/limit["rate"]
+            start = max(limit["next_time"], now)
+            limit["next_time"] = start + tokens*interval
+            delay = start - self.burst*interval - now
+        if delay > 0:
+            time.sleep(delay)
+
+    def on_success(self, limit_key):
+        '''
+            Function to raise a limit after a successful request.
+        '''
+        with self.lock:
+            limit = self._limit(limit_key)
+            max_rate = self.max_write_rate if limit_key[1] == "write" else self.max_read_rate
+            limit["rate"] = min(float(max_rate), limit["rate"] + self.increase/limit["rate"])
+
+    def on_throttle(self, limit_key):
+        '''
+            Function to lower a limit after a throttling error.
+        '''
+        with self.lock:
+            limit = self._limit(limit_key)
+            limit["throttles"] += 1
+            now = time.time()
+            if now - limit["last_decrease"] >= self.decrease_interval:
+                limit["rate"] = max(self.min_rate, limit["rate"]*self.decrease)
+                limit["last_decrease"] = now
+
+    def get_rate(self, path, write=True):
+        '''
+            Function to get the current rate limit, in requests per second, of requests on a s3 path.
+
+            USAGE:
+                get_rate_controller().get_rate('s3_bucket/s3_path/file.txt', write=False)
+        '''
+        bucket, _, key = path.partition("/")
+        with self.lock:
+            return self._limit(self.get_key(bucket, key, write))["rate"]
+
+    def rates(self):
+        '''
+            Function to get all limits in use.
+
+            OUTPUT:
+                A dict mapping (bucket/prefix, 'read' or 'write') to a dict with keys 'rate' (requests per second) and
+                'throttles' (throttling errors seen).
+        '''
+        with self.lock:
+            return dict((limit_key, {"rate":limit["rate"], "throttles":limit["throttles"]}) for limit_key, limit in self.limits.items())
+
+_rate_controller = RateController()
+
+def _on_rate_params(params, model, context, **kwargs):
+    controller = _rate_controller
+    if controller is None or "Bucket" not in params:
+        return
+    tokens = 1
+    if "Delete" in params:
+        objects = params["Delete"].get("Objects", [])
+        key = objects[0]["Key"] if objects else ""
+        tokens = max(len(objects), 1)
+    else:
+        key = params.get("Key", params.get("Prefix", ""))
+        if "Key" not in params:
+            key += "/"
+    write = not model.name.startswith(("Get", "Head", "List"))
+    context["boto3_utils_rate"] = (controller.get_key(params["Bucket"], key, write), tokens)
+
+def _on_rate_request(request, **kwargs):
+    # Emitted for every attempt, so that retries are limited too.
+    rate = request.context.get("boto3_utils_rate")
+    controller = _rate_controller
+    if rate is not None and controller is not None:
+        controller.acquire(*rate)
+
+def _on_rate_retry(response, request_dict, **kwargs):
+    rate = request_dict.get("context", {}).get("boto3_utils_rate")
+    controller = _rate_controller
+    if rate is not None and controller is not None and _is_throttled(response):
+        controller.on_throttle(rate[0])
+
+def _on_rate_after_call(http_response, context, **kwargs):
+    rate = context.get("boto3_utils_rate")
+    controller = _rate_controller
+    if rate is not None and controller is not None and http_response.status_code < 400:
+        controller.on_success(rate[0])
+
+_RATE_HANDLERS = [("before-parameter-build.s3", _on_rate_params), ("request-created.s3", _on_rate_request),
+                  ("needs-retry.s3", _on_rate_retry), ("after-call.s3", _on_rate_after_call)]
+
+def _register_rate_handlers(client):
+    for event, handler in _RATE_HANDLERS:
+        client.meta.events.register(event, handler, unique_id="boto3_utils-rate-" + event)
+
+def enable_rate_limiting(controller=None):
+    '''
+        Function to limit the requests of all S3 clients from get_client, i.e. of all helpers and all their bulk
+        operations, with a RateController. Rate limiting is enabled by default with a RateController using S3's
+        documented per-prefix rates; use this function to tune it.
+
+        PARAMETERS:
+            (OPTIONAL) controller (RateController): rate controller to use. Default is a new RateController.
+
+        OUTPUT:
+            The RateController in use.
+
+        USAGE:
+            controller = enable_rate_limiting(RateController(max_write_rate=1000, prefix_depth=2))
+            ...
+            controller.rates()
+    '''
+    global _rate_controller
+    with _clients_lock:
+        _rate_controller = controller or RateController()
+        for key, client in _clients.items():
+            if key[0] == "s3":
+                _register_rate_handlers(client)
+    return _rate_controller
+
+def disable_rate_limiting():
+    '''
+        Function to stop limiting S3 requests and unregister the event handlers from all clients.
+    '''
+    global _rate_controller
+    with _clients_lock:
+        _rate_controller = None
+        for key, client in _clients.items():
+            if key[0] == "s3":
+                for event, handler in _RATE_HANDLERS:
+                    client.meta.events.unregister(event, handler, unique_id="boto3_utils-rate-" + event)
+
+def get_rate_controller():
+    '''
+        Function to get the RateController in use, or None if rate limiting is disabled.
+    '''
+    return _rate_controller
+
+def _bounded_imap(func, iterable, max_workers):
+    '''
+        Utility generator to run func over the items of an iterable on a thread pool. At most 2*max_workers calls are
+        in flight at a time, so the iterable is consumed lazily and can itself still be producing items.
+
+        PARAMETERS:
+            func (function): function to be called with each item.
+            iterable (iterable): items to be processed.
+            max_workers (int): number of worker threads.
+
+        OUTPUT:
+            Yields (item, future) tuples in order of completion.
+    '''
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        pending = {}
+        for item in iterable:
+            pending[executor.submit(func, item)] = item
+            if len(pending) >= 2*max_workers:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield pending.pop(future), future
+        for future in as_completed(pending):
+            yield pending[future], future
+    finally:
+        executor.shutdown(wait=True)
+
+def _file_md5(fname):
+    '''
+        Utility function to get the hex md5 digest of a local file, read in 1 MB blocks.
+    '''
+    md5 = hashlib.md5()
+    with open(fname, "rb") as f:
+        for block in iter(lambda: f.read(1024*1024), b""):
+            md5.update(block)
+    return md5.hexdigest()
+
+def _iter_decompressed(f, path, chunk_size=1024*1024):
+    '''
+        Utility generator over the decompressed contents of a file object, in chunks. Decompression is chosen from the
+        extension of path: gzip for .gz, bzip2 for .bz2, none otherwise. Concatenated gzip/bzip2 streams are supported.
+    '''
+    if path.endswith(".gz"):
+        new_decompressor = lambda: zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif path.endswith(".bz2"):
+        new_decompressor = bz2.BZ2Decompressor
+    else:
+        new_decompressor = None
+    decompressor = new_decompressor() if new_decompressor else None
+    for chunk in iter(lambda: f.read(chunk_size), b""):
+        if decompressor is None:
+            yield chunk
+            continue
+        while chunk:
+            # A stream may end exactly on a chunk boundary, so start a new decompressor before feeding a finished one.
+            if getattr(decompressor, "eof", False):
+                decompressor = new_decompressor()
+            try:
+                data = decompressor.decompress(chunk)
+            except EOFError:
+                # Python 2 decompressors have no eof attribute, and bzip2 ones raise once their stream has ended.
+                decompressor = new_decompressor()
+                continue
+            yield data
+            chunk = decompressor.unused_data
+            if chunk:
+                decompressor = new_decompressor()
+
+def _iter_lines(f, path, encoding="utf-8"):
+    '''
+        Utility generator over the lines of a (possibly compressed) file object, decoded and without line endings.
+    '''
+    pending = b""
+    for chunk in _iter_decompressed(f, path):
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line.decode(encoding)
+    if pending:
+        yield pending.decode(encoding)
+
+DEFAULT_MANIFEST_PATH = os.path.join(os.path.expanduser("~"), ".boto3_utils_manifest.json")
+DEFAULT_ARCHIVE_DIR = os.path.join(os.path.expanduser("~"), ".boto3_utils_archives")
+
+def _load_manifest(manifest_path):
+    '''
+        Utility function to load the local upload manifest, mapping absolute local paths to their size, mtime and md5.
+        A missing or unreadable manifest is treated as empty.
+    '''
+    try:
+        with open(manifest_path) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+def _save_text(path, text):
+    '''
+        Utility function to write a local file, replacing the previous one only once fully written.
+    '''
+    tmp_path = path + ".%d.tmp" % os.getpid()
+    with open(tmp_path, "w") as f:
+        f.write(text)
+    if os.name == "nt" and os.path.exists(path):
+        os.remove(path)
+    os.rename(tmp_path, path)
+
+def _save_json(path, obj):
+    '''
+        Utility function to write a local JSON file (e.g. the upload manifest), replacing the previous one only once
+        fully written.
+    '''
+    _save_text(path, json.dumps(obj))
+
+class S3ReadStream(io.RawIOBase):
+    '''
+        Seekable, read-only file-like object over a s3 object, returned by AwsS3Helper.open. The object is read in
+        blocks with ranged GETs. The next prefetch blocks after the one being read are fetched in parallel ahead of
+        time, and up to cache_blocks blocks are kept in an LRU cache, so memory use is bounded by
+        cache_blocks*block_size regardless of the object size. Reads fail if the object changes while it is open.
+    '''
+
+    def __init__(self, conn, bucket, key, block_size=8*1024*1024, prefetch=4, cache_blocks=16):
+        io.RawIOBase.__init__(self)
+        self.conn = conn
+        self.bucket = bucket
+        self.key = key
+        self.block_size = block_size
+        self.prefetch = prefetch
+        self.cache_blocks = max(cache_blocks, prefetch + 1)
+        head = conn.head_object(Bucket=bucket, Key=key)
+        self.size = head["ContentLength"]
+        self.etag = head["ETag"]
+        self.pos = 0
+        self.blocks = OrderedDict()
+        self.executor = ThreadPoolExecutor(max_workers=max(prefetch, 1))
+
+    def _fetch(self, index):
+        '''
+            Utility function to fetch a block with a ranged GET.
+        '''
+        start = index*self.block_size
+        end = min(start + self.block_size, self.size) - 1
+        response = self.conn.get_object(Bucket=self.bucket, Key=self.key, Range="bytes=%d-%d" % (start, end), IfMatch=self.etag)
+        return response["Body"].read()
+
+    def _block(self, index):
+        '''
+            Utility function to get a block from the cache, fetching it and scheduling the following blocks if needed.
+        '''
+        num_blocks = -(-self.size//self.block_size)
+        for i in range(index, min(index + self.prefetch + 1, num_blocks)):
+            if i in self.blocks:
+                self.blocks[i] = self.blocks.pop(i)
+            else:
+                self.blocks[i] = self.executor.submit(self._fetch, i)
+        while len(self.blocks) > self.cache_blocks:
+            self.blocks.popitem(last=False)[1].cancel()
+        return self.blocks[index].result()
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self.pos + offset
+        elif whence == io.SEEK_END:
+            pos = self.size + offset
+        else:
+            raise ValueError("Unknown whence specified.")
+        if pos < 0:
+            raise ValueError("Negative seek position.")
+        self.pos = pos
+        return self.pos
+
+    def read(self, size=-1):
+        if self.closed:
+            raise ValueError("I/O operation on closed file.")
+        end = self.size if size is None or size < 0 else min(self.pos + size, self.size)
+        chunks = []
+        while self.pos < end:
+            index = self.pos//self.block_size
+            offset = self.pos - index*self.block_size
+            chunk = self._block(index)[offset:offset + end - self.pos]
+            chunks.append(chunk)
+            self.pos += len(chunk)
+        return b"".join(chunks)
+
+    def readall(self):
+        return self.read()
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def iter_chunks(self, chunk_size=None):
+        '''
+            Function to iterate over the rest of the object in chunks of chunk_size bytes (by default one block).
+        '''
+        chunk_size = chunk_size or self.block_size
+        while True:
+            chunk = self.read(chunk_size)
+            if not chunk: break
+            yield chunk
+
+    def iter_lines(self, keepends=False):
+        '''
+            Function to iterate over the rest of the object line by line, as bytes.
+        '''
+        pending = b""
+        for chunk in self.iter_chunks():
+            lines = (pending + chunk).split(b"\n")
+            pending = lines.pop()
+            for line in lines:
+                yield line + b"\n" if keepends else line
+        if pending:
+            yield pending
+
+    def close(self):
+        if not self.closed:
+            for future in self.blocks.values():
+                future.cancel()
+            self.blocks.clear()
+            self.executor.shutdown(wait=True)
+        io.RawIOBase.close(self)
+
+class S3WriteStream(io.RawIOBase):
+    '''
+        Write-only file-like object over a s3 object, returned by AwsS3Helper.open in 'wb' mode. Written bytes are
+        buffered into parts of part_size bytes which are uploaded as a multipart upload on a pool of max_workers
+        threads while writing continues; writes block while max_workers parts are in flight, so memory use is bounded
+        by about (max_workers + 1)*part_size. The upload is completed on close, and aborted if the with block exits
+        with an exception or abort is called. A stream garbage collected without being closed is aborted rather than
+        completed, since what was written may be truncated. Objects smaller than one part are uploaded with a single
+        PutObject.
+    '''
+
+    def __init__(self, conn, bucket, key, part_size=8*1024*1024, max_workers=4):
+        io.RawIOBase.__init__(self)
+        self.conn = conn
+        self.bucket = bucket
+        self.key = key
+        self.part_size = max(part_size, 5*1024*1024)
+        self.max_workers = max_workers
+        self.size = 0
+        self.buffer = bytearray()
+        self.parts = []
+        self.upload_id = None
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def _upload_part(self, part_number, data):
+        '''
+            Utility function to upload one part of the multipart upload.
+        '''
+        response = self.conn.upload_part(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, PartNumber=part_number, Body=data)
+        return {"PartNumber":part_number, "ETag":response["ETag"]}
+
+    def _submit(self, data):
+        '''
+            Utility function to schedule the upload of the next part, waiting while max_workers parts are in flight.
+        '''
+        if self.upload_id is None:
+            self.upload_id = self.conn.create_multipart_upload(Bucket=self.bucket, Key=self.key)["UploadId"]
+        pending = [future for future in self.parts if not future.done()]
+        if len(pending) >= self.max_workers:
+            wait(pending, return_when=FIRST_COMPLETED)
+        for future in self.parts:
+            if future.done() and future.exception() is not None:
+                raise future.exception()
+        self.parts.append(self.executor.submit(self._upload_part, len(self.parts) + 1, data))
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        if self.closed:
+            raise ValueError("I/O operation on closed file.")
+        self.buffer.extend(b)
+        while len(self.buffer) >= self.part_size:
+            part = bytes(self.buffer[:self.part_size])
+            del self.buffer[:self.part_size]
+            self._submit(part)
+        self.size += len(b)
+        return len(b)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self.upload_id is None:
+                self.conn.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self.buffer))
+            else:
+                if len(self.buffer) != 0:
+                    self._submit(bytes(self.buffer))
+                parts = [future.result() for future in self.parts]
+                self.conn.complete_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                                                    MultipartUpload={"Parts":parts})
+        except Exception:
+            self.abort()
+            raise
+        self.buffer = bytearray()
+        self.executor.shutdown(wait=True)
+        io.RawIOBase.close(self)
+
+    def abort(self):
+        '''
+            Function to discard everything written so far and abort the multipart upload, if one was started.
+        '''
+        self._abort(wait=True)
+
+    def _abort(self, wait):
+        '''
+            Utility function to abort the upload, waiting for parts in flight to finish only if wait is set.
+        '''
+        if self.closed:
+            return
+        for future in self.parts:
+            future.cancel()
+        self.executor.shutdown(wait=wait)
+        self.buffer = bytearray()
+        try:
+            if self.upload_id is not None:
+                self.conn.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+        finally:
+            io.RawIOBase.close(self)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+    def __del__(self):
+        # IOBase.__del__ would call close and complete the upload; an unclosed stream was abandoned, so abort it. This
+        # may run on a worker thread dropping the last reference, which can't wait for the pool it belongs to.
+        try:
+            self._abort(wait=False)
+        except Exception:
+            pass
 
 class AwsS3Helper:
     
-    def __init__(self,AWS_ACCESS_KEY_ID,AWS_SECRET_ACCESS_KEY,region_name="ap-southeast-1"):
+    def __init__(self,AWS_ACCESS_KEY_ID,AWS_SECRET_ACCESS_KEY,region_name="ap-southeast-1",max_pool_connections=50):
         '''
              Method to programatically access S3 objects.
 
@@ -16,10 +872,26 @@ class AwsS3Helper:
                 AWS_ACCESS_KEY_ID (string): Access Key associated with an AWS account.
                 AWS_SECRET_ACCESS_KEY (string): Corresponding Secret Key associated to the account.
                 (OPTIONAL) region_name (string): Region for the account. Set default to 'ap-southeast-1'. 
+                (OPTIONAL) max_pool_connections (int): size of the connection pool of the shared client. Default is 50.
+        '''
+
+        self.region_name = region_name
+        self.credentials = (AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY)
+        self.max_pool_connections = max_pool_connections
+        self._conn = None
+
+    @property
+    def conn(self):
+        '''
+            Shared S3 client, created on first use so that helpers are cheap to create.
         '''
+        if self._conn is None:
+            self._conn = get_client("s3", self.region_name, self.credentials[0], self.credentials[1], self.max_pool_connections)
+        return self._conn
 
-        self.conn = boto3.client("s3", region_name = region_name, aws_access_key_id = AWS_ACCESS_KEY_ID, \
-            aws_secret_access_key = AWS_SECRET_ACCESS_KEY)
+    @conn.setter
+    def conn(self, conn):
+        self._conn = conn
 
     def set_key(self, path):
         '''
@@ -72,6 +944,418 @@ class AwsS3Helper:
         bucket, key = self.set_key(path)
         self.conn.download_file(bucket, key, outfname)
 
+    def _transfer_config(self, max_workers, multipart_chunksize):
+        '''
+            Utility function to build the TransferConfig shared by all transfers of a bulk operation. Up to max_workers
+            files are transferred at once, each with max_concurrency threads of its own, so the per-file concurrency is
+            the connection pool split between the workers, keeping the total within max_pool_connections.
+        '''
+        from boto3.s3.transfer import TransferConfig
+        return TransferConfig(multipart_threshold=multipart_chunksize, multipart_chunksize=multipart_chunksize,
+                              max_concurrency=max(1, self.max_pool_connections // max_workers))
+
+    def _run_transfers(self, transfer, tasks, max_workers, skipped=0, target="local_path"):
+        '''
+            Utility function to run (s3_path, target, size) transfer tasks on a pool of worker threads.
+
+            OUTPUT:
+                A dict with keys 'files', 'bytes', 'seconds', 'files_per_sec', 'bytes_per_sec', 'skipped' and 'failed'
+                (a list of dicts with keys 'path', target and 'message').
+        '''
+        start = time.time()
+        report = {"files":0, "bytes":0, "skipped":skipped, "failed":[]}
+        for task, future in _bounded_imap(transfer, tasks, max_workers):
+            error = future.exception()
+            if error is None:
+                report["files"] += 1
+                report["bytes"] += task[2]
+            else:
+                report["failed"].append({"path":task[0], target:task[1], "message":str(error)})
+        report["seconds"] = time.time() - start
+        elapsed = max(report["seconds"], 1e-6)
+        report["files_per_sec"] = report["files"]/elapsed
+        report["bytes_per_sec"] = report["bytes"]/elapsed
+        return report
+
+    def _local_files(self, local_dir):
+        '''
+            Utility generator yielding (relative path with '/' separators, local path) of all files under local_dir.
+        '''
+        for root, _, fnames in os.walk(local_dir):
+            for fname in fnames:
+                local_path = os.path.join(root, fname)
+                yield os.path.relpath(local_path, local_dir).replace(os.sep, "/"), local_path
+
+    def _remote_files(self, s3_path):
+        '''
+            Utility generator yielding (relative path, entry as yielded by iter_keys) of all objects under s3_path,
+            skipping folder placeholders.
+        '''
+        bucket, key = self.set_key(s3_path)
+        prefix = key if key == "" or key.endswith("/") else key + "/"
+        for entry in self.iter_keys(bucket + "/" + prefix):
+            relpath = entry["path"][len(bucket) + 1 + len(prefix):]
+            if relpath and not relpath.endswith("/"):
+                yield relpath, entry
+
+    def _upload_task(self, config):
+        '''
+            Utility function returning a transfer function that uploads a (s3_path, local_path, size) task.
+        '''
+        def upload(task):
+            bucket, key = self.set_key(task[0])
+            self.conn.upload_file(task[1], bucket, key, Config=config)
+        return upload
+
+    def _local_target(self, local_dir, relpath):
+        '''
+            Utility function to get the local path under local_dir of an object's path relative to a s3 path.
+        '''
+        return os.path.normpath(os.path.join(local_dir, *relpath.split("/")))
+
+    def _download_task(self, config, local_dir, last_modified=None):
+        '''
+            Utility function returning a transfer function that downloads a (s3_path, local_path, size) task, creating
+            local directories as needed. Tasks whose local path resolves outside local_dir (e.g. from a key containing
+            '../') fail with ValueError. If last_modified maps the s3 path to an epoch, it is set as the file's mtime.
+        '''
+        root = os.path.join(os.path.realpath(local_dir), "")
+        def download(task):
+            if not os.path.realpath(task[1]).startswith(root):
+                raise ValueError("Local path %s is outside of %s." % (task[1], local_dir))
+            bucket, key = self.set_key(task[0])
+            parent = os.path.dirname(task[1])
+            if parent and not os.path.isdir(parent):
+                try:
+                    os.makedirs(parent)
+                except OSError:
+                    if not os.path.isdir(parent): raise
+            self.conn.download_file(bucket, key, task[1], Config=config)
+            if last_modified and task[0] in last_modified:
+                os.utime(task[1], (time.time(), last_modified[task[0]]))
+        return download
+
+    def upload_dir(self, s3_path, local_dir, max_workers=10, multipart_chunksize=8*1024*1024):
+        '''
+            To upload all files under a local directory to a s3 path. Files are uploaded on a pool of worker threads,
+            sharing one TransferConfig.
+
+            PARAMETERS:
+                s3_path (string): s3 path under which files are uploaded, keeping their path relative to local_dir.
+                local_dir (string): local directory to be uploaded.
+                (OPTIONAL) max_workers (int): number of files transferred in parallel. Default is 10.
+                (OPTIONAL) multipart_chunksize (int): part size in bytes for multipart transfers. Default is 8 MB.
+
+            OUTPUT:
+                A dict with keys 'files', 'bytes', 'seconds', 'files_per_sec', 'bytes_per_sec', 'skipped' and 'failed'
+                (a list of dicts with keys 'path', 'local_path' and 'message').
+
+            USAGE:
+                upload_dir('s3_bucket/s3_path/','/home/abc/local_dir/')
+        '''
+        prefix = s3_path.rstrip("/") + "/"
+        tasks = ((prefix + relpath, local_path, os.path.getsize(local_path)) for relpath, local_path in self._local_files(local_dir))
+        return self._run_transfers(self._upload_task(self._transfer_config(max_workers, multipart_chunksize)), tasks, max_workers)
+
+    def download_dir(self, s3_path, local_dir, max_workers=10, multipart_chunksize=8*1024*1024):
+        '''
+            To download all objects under a s3 path to a local directory. Objects are downloaded on a pool of worker
+            threads, sharing one TransferConfig. Objects whose key would place them outside local_dir (e.g. containing
+            '../') are not downloaded and are reported in 'failed'.
+
+            PARAMETERS:
+                s3_path (string): s3 path to be downloaded.
+                local_dir (string): local directory where objects are downloaded, keeping their path relative to s3_path.
+                (OPTIONAL) max_workers (int): number of files transferred in parallel. Default is 10.
+                (OPTIONAL) multipart_chunksize (int): part size in bytes for multipart transfers. Default is 8 MB.
+
+            OUTPUT:
+                Same report as upload_dir.
+
+            USAGE:
+                download_dir('s3_bucket/s3_path/','/home/abc/local_dir/')
+        '''
+        tasks = ((entry["path"], self._local_target(local_dir, relpath), entry["size"]) for relpath, entry in self._remote_files(s3_path))
+        return self._run_transfers(self._download_task(self._transfer_config(max_workers, multipart_chunksize), local_dir), tasks, max_workers)
+
+    def sync(self, local_dir, s3_path, direction="upload", compare_etag=False, max_workers=10, multipart_chunksize=8*1024*1024):
+        '''
+            To sync a local directory and a s3 path in one direction. Only files missing on the destination, or whose
+            size differs, or whose source copy is newer than the destination are transferred. Downloaded files get the
+            object's last modified time as their mtime. Files are never deleted from the destination. As in download_dir,
+            objects whose key would place them outside local_dir are reported in 'failed'.
+
+            PARAMETERS:
+                local_dir (string): local directory.
+                s3_path (string): s3 path.
+                (OPTIONAL) direction (string): Only two options - 'upload' (local_dir to s3_path) or 'download' (s3_path to local_dir). Default is 'upload'.
+                (OPTIONAL) compare_etag (bool): Flag to also compare the md5 of files of equal size against the ETag of
+                    objects not uploaded in multiple parts, transferring them if it differs regardless of mtime. Default is set to False.
+                (OPTIONAL) max_workers (int): number of files transferred in parallel. Default is 10.
+                (OPTIONAL) multipart_chunksize (int): part size in bytes for multipart transfers. Default is 8 MB.
+
+            OUTPUT:
+                Same report as upload_dir, 'skipped' being the number of files already in sync.
+
+            USAGE:
+                sync('/home/abc/local_dir/','s3_bucket/s3_path/',direction='download')
+        '''
+        if direction not in ["upload","download"]:
+            raise ValueError("Unknown direction specified. Direction must be one of: upload,download.")
+        remote = dict(self._remote_files(s3_path))
+        local = dict(self._local_files(local_dir)) if os.path.isdir(local_dir) else {}
+        prefix = s3_path.rstrip("/") + "/"
+        tasks = []
+        skipped = 0
+        if direction == "upload":
+            for relpath, local_path in local.items():
+                size = os.path.getsize(local_path)
+                if relpath not in remote or self._is_changed(local_path, size, remote[relpath], compare_etag, True):
+                    tasks.append((prefix + relpath, local_path, size))
+                else:
+                    skipped += 1
+            transfer = self._upload_task(self._transfer_config(max_workers, multipart_chunksize))
+        else:
+            last_modified = {}
+            for relpath, entry in remote.items():
+                local_path = local.get(relpath, self._local_target(local_dir, relpath))
+                if relpath not in local or self._is_changed(local_path, os.path.getsize(local_path), entry, compare_etag, False):
+                    tasks.append((entry["path"], local_path, entry["size"]))
+                    last_modified[entry["path"]] = calendar.timegm(entry["last_modified"].utctimetuple())
+                else:
+                    skipped += 1
+            transfer = self._download_task(self._transfer_config(max_workers, multipart_chunksize), local_dir, last_modified)
+        return self._run_transfers(transfer, tasks, max_workers, skipped)
+
+    def _is_changed(self, local_path, size, entry, compare_etag, upload):
+        '''
+            Utility function to decide whether a local file and an object listed by iter_keys differ for sync.
+        '''
+        if size != entry["size"]:
+            return True
+        if compare_etag and "-" not in entry["etag"]:
+            return _file_md5(local_path) != entry["etag"]
+        local_mtime = int(os.path.getmtime(local_path))
+        remote_mtime = calendar.timegm(entry["last_modified"].utctimetuple())
+        return local_mtime > remote_mtime if upload else remote_mtime > local_mtime
+
+    def _cached_md5(self, fname, manifest):
+        '''
+            Utility function to get the md5 of a local file, only hashing it again if its size or mtime changed since
+            it was recorded in manifest.
+        '''
+        stat = os.stat(fname)
+        abs_path = os.path.abspath(fname)
+        entry = manifest.get(abs_path)
+        if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            return entry["md5"]
+        md5 = _file_md5(fname)
+        manifest[abs_path] = {"size":stat.st_size, "mtime":stat.st_mtime, "md5":md5}
+        return md5
+
+    def _remote_md5(self, path):
+        '''
+            Utility function to get the md5 of a s3 object, from the 'md5' metadata set by upload_changed or else from
+            the ETag of objects not uploaded in multiple parts.
+
+            OUTPUT:
+                md5 (string), or None if the object doesn't exist or its md5 isn't known.
+        '''
+        from botocore.exceptions import ClientError
+        bucket, key = self.set_key(path)
+        try:
+            head = self.conn.head_object(Bucket=bucket, Key=key)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ["404","NoSuchKey","NotFound"]:
+                return None
+            raise
+        etag = head["ETag"].strip('"')
+        return head.get("Metadata", {}).get("md5", None if "-" in etag else etag)
+
+    def upload_changed(self, uploads, manifest_path=DEFAULT_MANIFEST_PATH, max_workers=10):
+        '''
+            To upload local files only if they differ from the s3 objects they are uploaded to. Each file's md5 is kept
+            in a local manifest (so unchanged files aren't hashed again) and compared against the md5 stored with the
+            object. Files that need uploading are uploaded on a pool of worker threads.
+
+            PARAMETERS:
+                uploads (list): list of (s3 path, local path) tuples.
+                (OPTIONAL) manifest_path (string): local path of the manifest. Default is ~/.boto3_utils_manifest.json.
+                (OPTIONAL) max_workers (int): number of files hashed and uploaded in parallel. Default is 10.
+
+            OUTPUT:
+                A dict with keys 'uploaded' and 'skipped', each a list of s3 paths.
+
+            USAGE:
+                upload_changed([('s3_bucket/src_path/map.py','/home/abc/map.py'),('s3_bucket/cache/dict.p','/home/abc/dict.p')])
+        '''
+        manifest = _load_manifest(manifest_path)
+
+        def upload(task):
+            path, fname = task
+            md5 = self._cached_md5(fname, manifest)
+            if self._remote_md5(path) == md5:
+                return False
+            bucket, key = self.set_key(path)
+            self.conn.upload_file(fname, bucket, key, ExtraArgs={"Metadata":{"md5":md5}})
+            return True
+
+        result = {"uploaded":[], "skipped":[]}
+        errors = []
+        for task, future in _bounded_imap(upload, uploads, max_workers):
+            if future.exception() is not None:
+                errors.append(future.exception())
+            elif future.result():
+                result["uploaded"].append(task[0])
+            else:
+                result["skipped"].append(task[0])
+        _save_json(manifest_path, manifest)
+        if len(errors) != 0:
+            raise errors[0]
+        return result
+
+    def open(self, path, mode="rb", block_size=8*1024*1024, prefetch=4, cache_blocks=16, part_size=8*1024*1024, max_workers=4):
+        '''
+            To open a s3 object as a file-like object, without going through a local file.
+
+            In 'rb' mode, the object is seekable and read in blocks with ranged GETs; upcoming blocks are prefetched in
+            parallel and recent blocks are kept in a bounded LRU cache. Besides read, seek and tell, it offers
+            iter_lines() and iter_chunks().
+
+            In 'wb' mode, written bytes are uploaded as parts of a multipart upload in parallel while writing continues,
+            with bounded memory. The object is created only when the stream is closed without an exception: leaving a
+            with block with an exception, calling abort(), or dropping the stream without closing it aborts the upload.
+
+            PARAMETERS:
+                path (string): s3 path of object. Should be specified as bucket + key.
+                (OPTIONAL) mode (string): Only two options - 'rb' or 'wb'. Default is 'rb'.
+                (OPTIONAL) block_size (int): 'rb' only. Size in bytes of each ranged GET. Default is 8 MB.
+                (OPTIONAL) prefetch (int): 'rb' only. Number of blocks fetched ahead of the one being read. Default is 4.
+                (OPTIONAL) cache_blocks (int): 'rb' only. Number of blocks kept in memory. Default is 16.
+                (OPTIONAL) part_size (int): 'wb' only. Size in bytes of each uploaded part, at least 5 MB. Default is 8 MB.
+                (OPTIONAL) max_workers (int): 'wb' only. Number of parts uploaded in parallel. Default is 4.
+
+            RETURNS: S3ReadStream or S3WriteStream
+
+            USAGE:
+                with conn_s3.open('s3_bucket/s3_path/part-00000') as f:
+                    for line in f.iter_lines():
+                        print(line)
+                with conn_s3.open('s3_bucket/s3_path/out.txt', 'wb') as f:
+                    f.write(b'some data')
+        '''
+        bucket, key = self.set_key(path)
+        if mode == "rb":
+            return S3ReadStream(self.conn, bucket, key, block_size=block_size, prefetch=prefetch, cache_blocks=cache_blocks)
+        if mode == "wb":
+            return S3WriteStream(self.conn, bucket, key, part_size=part_size, max_workers=max_workers)
+        raise ValueError("Unknown mode specified. Mode must be one of: rb,wb.")
+
+    def upload_stream(self, path, iterable, part_size=8*1024*1024, max_workers=4):
+        '''
+            To upload a s3 object from an iterable of bytes chunks (e.g. a generator), without a local file. Chunks are
+            uploaded as a parallel multipart upload as they are produced. The object is created only once the iterable
+            is exhausted without an exception; the upload is aborted if the iterable raises.
+
+            PARAMETERS:
+                path (string): s3 path where object to be uploaded. Should be specified as bucket + key.
+                iterable (iterable): bytes chunks of the object.
+                (OPTIONAL) part_size (int): size in bytes of each uploaded part, at least 5 MB. Default is 8 MB.
+                (OPTIONAL) max_workers (int): number of parts uploaded in parallel. Default is 4.
+
+            RETURNS: size of the uploaded object in bytes (int)
+
+            USAGE:
+                upload_stream('s3_bucket/s3_path/out.txt', (line.encode() + b'\\n' for line in lines))
+        '''
+        with self.open(path, "wb", part_size=part_size, max_workers=max_workers) as f:
+            for chunk in iterable:
+                f.write(chunk)
+        return f.size
+
+    def _fetch_part(self, path, spool_size=64*1024*1024):
+        '''
+            Utility function to download a s3 object into a temporary file, kept in memory up to spool_size bytes (64
+            MB by default). With a spool_size of 0 the file is written straight to disk.
+        '''
+        bucket, key = self.set_key(path)
+        f = tempfile.SpooledTemporaryFile(max_size=spool_size) if spool_size else tempfile.TemporaryFile()
+        try:
+            self.conn.download_fileobj(bucket, key, f)
+            f.seek(0)
+        except Exception:
+            f.close()
+            raise
+        return f
+
+    def iter_prefix_records(self, prefix_name, ordered=True, merge=False, sort_key=None, max_workers=4, prefetch=8, encoding="utf-8"):
+        '''
+            To read the records (lines) of all part-* files under a s3 path, e.g. the output of a hadoop-streaming job.
+            Part files are downloaded concurrently, at most prefetch parts ahead of the one being read, and gzip (.gz)
+            and bzip2 (.bz2) parts are decompressed transparently.
+
+            PARAMETERS:
+                prefix_name (string): s3 path of folder containing part files.
+                (OPTIONAL) ordered (bool): Flag to yield parts in part order. Set to False to yield each part as soon as it is downloaded. Default is set to True.
+                (OPTIONAL) merge (bool): Flag to merge-sort the records of parts that are each sorted (e.g. reducer outputs), once all parts are downloaded to temporary files on disk. Default is set to False.
+                (OPTIONAL) sort_key (function): key of a record for merge. Default is the hadoop-streaming key, i.e. the record up to the first tab.
+                (OPTIONAL) max_workers (int): number of parts downloaded in parallel. Default is 4.
+                (OPTIONAL) prefetch (int): number of parts downloaded ahead of the one being read, in ordered mode. Default is 8.
+                (OPTIONAL) encoding (string): encoding of the records. Default is 'utf-8'.
+
+            OUTPUT:
+                Yields records as strings, without line endings.
+
+            USAGE:
+                for record in iter_prefix_records('s3_bucket/job_output/'):
+                    key, value = record.split('\\t', 1)
+        '''
+        parts = sorted(entry["path"] for entry in self.iter_keys(prefix_name) if entry["path"].split("/")[-1].startswith("part-"))
+
+        if merge:
+            # Every part is downloaded before merging, so they go to disk rather than being held in memory.
+            files = {}
+            try:
+                for path, future in _bounded_imap(lambda path: self._fetch_part(path, spool_size=0), parts, max_workers):
+                    files[path] = future.result()
+                sort_key = sort_key or (lambda record: record.split("\t", 1)[0])
+                streams = [((sort_key(record), i, record) for record in _iter_lines(files[path], path, encoding))
+                           for i, path in enumerate(parts)]
+                for _, _, record in heapq.merge(*streams):
+                    yield record
+            finally:
+                for f in files.values():
+                    f.close()
+            return
+
+        if not ordered:
+            for path, future in _bounded_imap(self._fetch_part, parts, max_workers):
+                f = future.result()
+                try:
+                    for record in _iter_lines(f, path, encoding):
+                        yield record
+                finally:
+                    f.close()
+            return
+
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        futures = []
+        try:
+            for i, path in enumerate(parts):
+                while len(futures) < min(len(parts), i + 1 + prefetch):
+                    futures.append(executor.submit(self._fetch_part, parts[len(futures)]))
+                f = futures[i].result()
+                try:
+                    for record in _iter_lines(f, path, encoding):
+                        yield record
+                finally:
+                    f.close()
+        finally:
+            for future in futures:
+                if not future.cancel() and future.done() and future.exception() is None:
+                    future.result().close()
+            executor.shutdown(wait=True)
+
     def del_file(self, path):
         '''
             To delete a s3 object.
@@ -87,6 +1371,167 @@ class AwsS3Helper:
         bucket, key = self.set_key(path)
         self.conn.delete_object(Bucket=bucket,Key=key)
 
+    def _delete_batch(self, batch):
+        '''
+            Utility function to delete a batch of keys from a bucket with a single DeleteObjects request.
+
+            PARAMETERS:
+                batch (tuple): (bucket, list of keys). At most 1000 keys per batch.
+
+            OUTPUT:
+                A list of dicts, one per key that couldn't be deleted, with keys 'path', 'code' and 'message'.
+        '''
+        bucket, keys = batch
+        response = self.conn.delete_objects(Bucket=bucket, Delete={"Objects":[{"Key":key} for key in keys], "Quiet":True})
+        return [{"path":bucket + "/" + error["Key"], "code":error.get("Code"), "message":error.get("Message")}
+                for error in response.get("Errors", [])]
+
+    def delete_keys(self, paths, max_workers=10):
+        '''
+            To delete many s3 objects. Keys are grouped per bucket into DeleteObjects batches of up to 1000 keys and the
+            batches are sent from a pool of worker threads. paths is consumed lazily, so batches are sent while it is
+            still being produced (for example while a listing is still running).
+
+            PARAMETERS:
+                paths (iterable): s3 paths of objects to be deleted.
+                (OPTIONAL) max_workers (int): number of batches deleted in parallel. Default is 10.
+
+            OUTPUT:
+                A list of dicts, one per object that couldn't be deleted, with keys 'path', 'code' and 'message'.
+                An empty list means every object was deleted.
+
+            USAGE:
+                delete_keys(['s3_bucket/s3_path/1.txt','s3_bucket/s3_path/2.txt'])
+        '''
+        def batches():
+            pending = {}
+            for path in paths:
+                bucket, key = self.set_key(path)
+                keys = pending.setdefault(bucket, [])
+                keys.append(key)
+                if len(keys) == 1000:
+                    yield bucket, pending.pop(bucket)
+            for bucket in pending:
+                yield bucket, pending[bucket]
+
+        failed = []
+        for batch, future in _bounded_imap(self._delete_batch, batches(), max_workers):
+            error = future.exception()
+            if error is None:
+                failed.extend(future.result())
+            else:
+                bucket, keys = batch
+                failed.extend({"path":bucket + "/" + key, "code":type(error).__name__, "message":str(error)} for key in keys)
+        return failed
+
+    def delete_prefix(self, prefix_name, max_workers=10):
+        '''
+            To delete a s3 path and all objects under it. Deletion starts as soon as the first listing page arrives.
+
+            PARAMETERS:
+                prefix_name (string): s3 path of folder/object to be deleted.
+                (OPTIONAL) max_workers (int): number of batches deleted in parallel. Default is 10.
+
+            OUTPUT:
+                A list of dicts, one per object that couldn't be deleted, with keys 'path', 'code' and 'message'.
+
+            USAGE:
+                delete_prefix('s3_bucket/s3_path/')
+        '''
+        return self.delete_keys((entry["path"] for entry in self.iter_keys(prefix_name)), max_workers=max_workers)
+
+    def _list_pages(self, bucket, key, delimiter=None):
+        '''
+            Utility generator over ListObjectsV2 pages of a prefix.
+
+            OUTPUT:
+                Yields (entries, common_prefixes) per page, where entries is a list of dicts as yielded by iter_keys and
+                common_prefixes is a list of keys (only populated when delimiter is set).
+        '''
+        params = {"Bucket":bucket, "Prefix":key}
+        if delimiter:
+            params["Delimiter"] = delimiter
+        for page in self.conn.get_paginator("list_objects_v2").paginate(**params):
+            entries = [{"path":bucket + "/" + x["Key"], "size":x["Size"], "etag":x["ETag"].strip('"'),
+                        "last_modified":x["LastModified"]} for x in page.get("Contents", [])]
+            yield entries, [x["Prefix"] for x in page.get("CommonPrefixes", [])]
+
+    def iter_keys(self, prefix_name, parallel=False, delimiter="/", max_workers=10):
+        '''
+            Used to list files in a S3 object/folder as a generator. Entries are yielded as each page of the listing
+            arrives, so memory use doesn't grow with the size of the listing.
+
+            In parallel mode, the prefix is first listed with delimiter and every common prefix found (i.e. every
+            sub-folder) is then listed as a separate shard on a pool of worker threads. Use it for prefixes with
+            millions of keys spread over sub-folders. Entries are not yielded in key order in parallel mode.
+
+            PARAMETERS:
+                prefix_name (string): s3 path of folder/object
+                (OPTIONAL) parallel (bool): Flag to list sub-folders concurrently. Default is set to False.
+                (OPTIONAL) delimiter (string): delimiter used to split the prefix into shards in parallel mode. Default is '/'.
+                (OPTIONAL) max_workers (int): number of shards listed in parallel. Default is 10.
+
+            OUTPUT:
+                Yields dicts with keys 'path' (s3 path), 'size' (bytes), 'etag' (string, without quotes) and
+                'last_modified' (Python datetime object).
+
+            USAGE:
+                for entry in iter_keys('s3_bucket/s3_path/', parallel=True):
+                    print(entry['path'], entry['size'])
+        '''
+        bucket, key = self.set_key(prefix_name)
+        if not parallel:
+            for entries, _ in self._list_pages(bucket, key):
+                for entry in entries:
+                    yield entry
+            return
+
+        shards = []
+        for entries, prefixes in self._list_pages(bucket, key, delimiter):
+            for entry in entries:
+                yield entry
+            shards.extend(prefixes)
+        if len(shards) == 0:
+            return
+
+        pages = Queue(maxsize=2*max_workers)
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=1)
+                    return True
+                except Full:
+                    pass
+            return False
+
+        def list_shard(shard):
+            try:
+                for entries, _ in self._list_pages(bucket, shard):
+                    if not put(entries): return
+                put(None)
+            except Exception as e:
+                put(e)
+
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            for shard in shards:
+                executor.submit(list_shard, shard)
+            remaining = len(shards)
+            while remaining:
+                entries = pages.get()
+                if entries is None:
+                    remaining -= 1
+                elif isinstance(entries, Exception):
+                    raise entries
+                else:
+                    for entry in entries:
+                        yield entry
+        finally:
+            stop.set()
+            executor.shutdown(wait=True)
+
     def list_keys(self, prefix_name):
         ''' 
             Used to list files in a S3 object/folder.
@@ -95,31 +1540,25 @@ class AwsS3Helper:
                 prefix_name (string): s3 path of folder/object
 
             OUPTUT:
-                A list of strings containing s3 paths.
+                A list of strings containing s3 paths. Use iter_keys to stream the listing along with object metadata.
 
             USAGE:
                 list_keys('s3_bucket/s3_path/')
         '''
-        bucket, key = self.set_key(prefix_name)
-        is_truncated = True
-        result = []
-        marker = ""
-        while is_truncated:
-            response = self.conn.list_objects(Bucket=bucket,Prefix=key,Delimiter=",",Marker=marker)
-            if "Contents" not in response: break
-            result.extend(response["Contents"])
-            is_truncated = response["IsTruncated"]
-            if "NextMarker" not in response: break
-            marker = response["NextMarker"]
-        return map(lambda x:bucket + "/" + x["Key"], result)
+        return [entry["path"] for entry in self.iter_keys(prefix_name)]
                 
-    def copy_key(self, src_key, dst_key):
+    def copy_key(self, src_key, dst_key, multipart_threshold=1024**3, part_size=256*1024**2, max_workers=10, size=None):
         '''
-            Used to copy file from one s3 path to another
+            Used to copy file from one s3 path to another. Objects larger than multipart_threshold (and any object over
+            the 5 GB limit of a single copy) are copied server side in byte ranges with a parallel multipart copy.
 
             PARAMETERS:
                 src_key (string): s3 path from where file to be copied
                 dst_key (string): s3 path where file to be copied
+                (OPTIONAL) multipart_threshold (int): size in bytes above which multipart copy is used. Default is 1 GB.
+                (OPTIONAL) part_size (int): size in bytes of each copied part. Default is 256 MB.
+                (OPTIONAL) max_workers (int): number of parts copied in parallel. Default is 10.
+                (OPTIONAL) size (int): size of the source object in bytes, if already known. Saves a HeadObject call.
 
             OUTPUT: None
 
@@ -128,7 +1567,238 @@ class AwsS3Helper:
 
         '''
         bucket ,key = self.set_key(dst_key)
-        self.conn.copy_object(Bucket=bucket,CopySource=src_key,Key=key)
+        if size is None:
+            src_bucket, src_path = self.set_key(src_key)
+            size = self.conn.head_object(Bucket=src_bucket, Key=src_path)["ContentLength"]
+        if size <= min(multipart_threshold, 5*1024**3):
+            self.conn.copy_object(Bucket=bucket,CopySource=src_key,Key=key)
+        else:
+            self._multipart_copy(src_key, dst_key, size, part_size, max_workers)
+
+    def _multipart_copy(self, src_key, dst_key, size, part_size, max_workers):
+        '''
+            Utility function to copy an object with UploadPartCopy over byte ranges, copying parts on a pool of worker
+            threads. Content type and metadata of the source are kept. The multipart upload is aborted on error.
+        '''
+        src_bucket, src_path = self.set_key(src_key)
+        bucket, key = self.set_key(dst_key)
+        head = self.conn.head_object(Bucket=src_bucket, Key=src_path)
+        params = {"Bucket":bucket, "Key":key, "Metadata":head.get("Metadata", {})}
+        if "ContentType" in head:
+            params["ContentType"] = head["ContentType"]
+        upload_id = self.conn.create_multipart_upload(**params)["UploadId"]
+        part_size = max(part_size, 5*1024**2, -(-size//10000))
+
+        def copy_part(part_number):
+            start = (part_number - 1)*part_size
+            end = min(start + part_size, size) - 1
+            response = self.conn.upload_part_copy(Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=part_number,
+                                                  CopySource={"Bucket":src_bucket, "Key":src_path},
+                                                  CopySourceRange="bytes=%d-%d" % (start, end))
+            return {"PartNumber":part_number, "ETag":response["CopyPartResult"]["ETag"]}
+
+        try:
+            parts = []
+            for _, future in _bounded_imap(copy_part, range(1, -(-size//part_size) + 1), max_workers):
+                parts.append(future.result())
+            parts.sort(key=lambda x:x["PartNumber"])
+            self.conn.complete_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id, MultipartUpload={"Parts":parts})
+        except Exception:
+            self.conn.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+            raise
+
+    def copy_prefix(self, src_prefix, dst_prefix, max_workers=10, multipart_threshold=1024**3, part_size=256*1024**2):
+        '''
+            Used to copy all files under a s3 path to another s3 path, server side. Objects are copied on a pool of
+            worker threads while the source path is still being listed; large objects use multipart copy as in copy_key.
+
+            PARAMETERS:
+                src_prefix (string): s3 path from where files to be copied
+                dst_prefix (string): s3 path where files to be copied, keeping their path relative to src_prefix
+                (OPTIONAL) max_workers (int): number of objects copied in parallel. Default is 10.
+                (OPTIONAL) multipart_threshold (int): size in bytes above which multipart copy is used. Default is 1 GB.
+                (OPTIONAL) part_size (int): size in bytes of each copied part. Default is 256 MB.
+
+            OUTPUT:
+                A dict with keys 'files', 'bytes', 'seconds', 'files_per_sec', 'bytes_per_sec', 'skipped' and 'failed'
+                (a list of dicts with keys 'path', 'dst_path' and 'message').
+
+            USAGE:
+                copy_prefix('s3_bucket1/emr_output/','s3_bucket2/published/emr_output/')
+        '''
+        prefix = dst_prefix.rstrip("/") + "/"
+        tasks = ((entry["path"], prefix + relpath, entry["size"]) for relpath, entry in self._remote_files(src_prefix))
+
+        def copy(task):
+            self.copy_key(task[0], task[1], multipart_threshold=multipart_threshold, part_size=part_size, size=task[2])
+        return self._run_transfers(copy, tasks, max_workers, target="dst_path")
+
+    def _compact_blocks(self, src_prefix, dst_prefix, block_size, compress):
+        '''
+            Utility generator grouping the objects under src_prefix into (first s3 path, dst_path, size, entries) block
+            tasks of up to block_size bytes. Objects are grouped by compression (extension), since gzip and bzip2
+            streams can only be concatenated with streams of the same kind, unless compress is set. Objects of
+            block_size bytes or more are blocks of their own. Empty objects and names starting with '_' or '.' (e.g.
+            _SUCCESS) are skipped.
+        '''
+        prefix = dst_prefix.rstrip("/") + "/"
+        blocks = {}
+        count = [0]
+
+        def block(entries):
+            if compress and len(entries) > 1:
+                ext = ".bz2"
+            else:
+                ext = os.path.splitext(entries[0]["path"])[1] if entries[0]["path"].endswith((".gz", ".bz2")) else ""
+            path = prefix + "part-%05d" % count[0] + ext
+            count[0] += 1
+            return entries[0]["path"], path, sum(entry["size"] for entry in entries), entries
+
+        for relpath, entry in self._remote_files(src_prefix):
+            if entry["size"] == 0 or relpath.split("/")[-1].startswith(("_", ".")):
+                continue
+            if entry["size"] >= block_size:
+                yield block([entry])
+                continue
+            group = "" if compress or not relpath.endswith((".gz", ".bz2")) else os.path.splitext(relpath)[1]
+            entries, size = blocks.get(group, ([], 0))
+            if size + entry["size"] > block_size:
+                yield block(entries)
+                entries, size = [], 0
+            entries.append(entry)
+            blocks[group] = (entries, size + entry["size"])
+        for group in sorted(blocks):
+            yield block(blocks[group][0])
+
+    def _read_object(self, path):
+        '''
+            Utility function to read a (small) s3 object into memory with a single GetObject call.
+        '''
+        bucket, key = self.set_key(path)
+        return self.conn.get_object(Bucket=bucket, Key=key)["Body"].read()
+
+    def _ends_with_newline(self, path):
+        '''
+            Utility function to check the last byte of a s3 object with a ranged GET.
+        '''
+        bucket, key = self.set_key(path)
+        return self.conn.get_object(Bucket=bucket, Key=key, Range="bytes=-1")["Body"].read() == b"\n"
+
+    def _concat_objects(self, dst_path, entries, part_size, fetch_workers):
+        '''
+            Utility function to concatenate s3 objects into dst_path with a multipart upload. Objects of at least 5 MB
+            are copied server side with UploadPartCopy; smaller ones, which can't be parts on their own, are fetched
+            in parallel and uploaded together in parts of part_size bytes. Uncompressed objects are separated by a
+            newline where they don't end with one. The multipart upload is aborted on error.
+        '''
+        bucket, key = self.set_key(dst_path)
+        compressed = dst_path.endswith((".gz", ".bz2"))
+        copied = []
+        fetched = []
+        for entry in entries:
+            if entry["size"] >= 5*1024*1024 and (compressed or self._ends_with_newline(entry["path"])):
+                copied.append(entry)
+            else:
+                fetched.append(entry)
+        upload_id = self.conn.create_multipart_upload(Bucket=bucket, Key=key)["UploadId"]
+        try:
+            parts = []
+            for entry in copied:
+                src_bucket, src_key = self.set_key(entry["path"])
+                response = self.conn.upload_part_copy(Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=len(parts) + 1,
+                                                      CopySource={"Bucket":src_bucket, "Key":src_key})
+                parts.append({"PartNumber":len(parts) + 1, "ETag":response["CopyPartResult"]["ETag"]})
+
+            # Fetched objects go last, so that only the final part can be smaller than 5 MB.
+            buffer = bytearray()
+            for _, future in _bounded_imap(lambda entry: self._read_object(entry["path"]), fetched, fetch_workers):
+                data = future.result()
+                buffer.extend(data)
+                if not compressed and not data.endswith(b"\n"):
+                    buffer.extend(b"\n")
+                if len(buffer) >= part_size:
+                    response = self.conn.upload_part(Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=len(parts) + 1, Body=bytes(buffer))
+                    parts.append({"PartNumber":len(parts) + 1, "ETag":response["ETag"]})
+                    buffer = bytearray()
+            if len(buffer) != 0:
+                response = self.conn.upload_part(Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=len(parts) + 1, Body=bytes(buffer))
+                parts.append({"PartNumber":len(parts) + 1, "ETag":response["ETag"]})
+            self.conn.complete_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id, MultipartUpload={"Parts":parts})
+        except Exception:
+            self.conn.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+            raise
+
+    def _recompress_objects(self, dst_path, entries, part_size, fetch_workers):
+        '''
+            Utility function to write the decompressed contents of s3 objects, separated by newlines where needed, to
+            dst_path as a single bzip2 stream. Objects are fetched in parallel into temporary files and the output is
+            uploaded as a streaming multipart upload, so memory use is bounded.
+        '''
+        compressor = bz2.BZ2Compressor()
+        with self.open(dst_path, "wb", part_size=part_size) as out:
+            for entry, future in _bounded_imap(lambda entry: self._fetch_part(entry["path"]), entries, fetch_workers):
+                with future.result() as f:
+                    last = b"\n"
+                    for chunk in _iter_decompressed(f, entry["path"]):
+                        if chunk:
+                            out.write(compressor.compress(chunk))
+                            last = chunk[-1:]
+                    if last != b"\n":
+                        out.write(compressor.compress(b"\n"))
+            out.write(compressor.flush())
+
+    def compact_prefix(self, src_prefix, dst_prefix, block_size=128*1024**2, compress=False, part_size=64*1024**2,
+                       max_workers=10, fetch_workers=16):
+        '''
+            Used to concatenate the many small objects under a s3 path into few objects of about block_size bytes
+            under another path, e.g. so that a hadoop job reading them runs one map task per block instead of one per
+            object. Blocks are written on a pool of worker threads while the source path is still being listed.
+            Objects of 5 MB or more are copied into their block server side with UploadPartCopy, smaller ones are
+            fetched (fetch_workers at a time per block) and uploaded as parts. Objects of block_size bytes or more are
+            copied as they are. Gzip and bzip2 objects are only concatenated with objects of the same kind.
+
+            With compress set, blocks are instead written as bzip2, which hadoop can split, from the decompressed
+            contents of their objects. Nothing is copied server side then, as every byte has to be recompressed.
+
+            PARAMETERS:
+                src_prefix (string): s3 path of the objects to be compacted
+                dst_prefix (string): s3 path where blocks are written, as part-00000, part-00001, ... It can't be under src_prefix, or the reverse.
+                (OPTIONAL) block_size (int): target size in bytes of each block, at most 5 GB. Default is 128 MB.
+                (OPTIONAL) compress (bool): Flag to write blocks compressed with bzip2. Default is set to False.
+                (OPTIONAL) part_size (int): size in bytes of each uploaded part, at least 5 MB. Default is 64 MB.
+                (OPTIONAL) max_workers (int): number of blocks written in parallel. Default is 10.
+                (OPTIONAL) fetch_workers (int): number of small objects fetched in parallel for each block. Default is 16.
+
+            OUTPUT:
+                A dict with keys 'files' (blocks written), 'objects' (objects compacted), 'bytes', 'seconds',
+                'files_per_sec', 'bytes_per_sec', 'skipped' and 'failed' (a list of dicts with keys 'path', 'dst_path'
+                and 'message').
+
+            USAGE:
+                compact_prefix('s3_bucket/raw_events/','s3_bucket/compacted/raw_events/',block_size=256*1024**2)
+        '''
+        if block_size > 5*1024**3:
+            raise ValueError("block_size must be at most 5 GB.")
+        src, dst = src_prefix.rstrip("/") + "/", dst_prefix.rstrip("/") + "/"
+        if src.startswith(dst) or dst.startswith(src):
+            raise ValueError("src_prefix %s and dst_prefix %s can't contain one another." % (src, dst))
+        part_size = max(part_size, 5*1024*1024)
+        objects = []
+
+        def compact(task):
+            _, dst_path, size, entries = task
+            if len(entries) == 1:
+                self.copy_key(entries[0]["path"], dst_path, size=size)
+            elif compress:
+                self._recompress_objects(dst_path, entries, part_size, fetch_workers)
+            else:
+                self._concat_objects(dst_path, entries, part_size, fetch_workers)
+            objects.append(len(entries))
+
+        report = self._run_transfers(compact, self._compact_blocks(src_prefix, dst_prefix, block_size, compress),
+                                     max_workers, target="dst_path")
+        report["objects"] = sum(objects)
+        return report
 
     def get_last_modified(self, path):
         '''
@@ -142,13 +1812,99 @@ class AwsS3Helper:
             USAGE:
                 get_last_modified('s3_bucket/s3_path/file.txt')
         '''
-        bucket, key = self.set_key(path)
-        object_info = self.resource.Object(bucket, key)
-        timestamp = object_info.last_modified
-        return timestamp
+        stats, errors = self.stat_many([path], max_workers=1)
+        if path in errors:
+            raise errors[path]
+        return stats[path]["last_modified"]
+
+    def stat_many(self, paths, max_workers=20):
+        '''
+            To get metadata of many s3 objects, with HeadObject calls made on a pool of worker threads.
+
+            PARAMETERS:
+                paths (iterable): s3 paths of objects.
+                (OPTIONAL) max_workers (int): number of objects looked up in parallel. Default is 20.
+
+            OUTPUT:
+                A tuple (stats, errors). stats maps each s3 path found to a dict with keys 'path', 'size' (bytes),
+                'etag' (string, without quotes) and 'last_modified' (Python datetime object). errors maps each s3 path
+                that couldn't be looked up (e.g. missing objects) to the exception raised.
+
+            USAGE:
+                stats, errors = stat_many(['s3_bucket/s3_path/1.txt','s3_bucket/s3_path/2.txt'])
+        '''
+        def stat(path):
+            bucket, key = self.set_key(path)
+            head = self.conn.head_object(Bucket=bucket, Key=key)
+            return {"path":path, "size":head["ContentLength"], "etag":head["ETag"].strip('"'), "last_modified":head["LastModified"]}
+
+        stats = {}
+        errors = {}
+        for path, future in _bounded_imap(stat, paths, max_workers):
+            if future.exception() is None:
+                stats[path] = future.result()
+            else:
+                errors[path] = future.exception()
+        return stats, errors
+
+SPOT_PRICE_URL = "https://spot-price.s3.amazonaws.com/spot.js"
+
+# Region names used by the spot price feed, where they differ from the AWS region names.
+SPOT_FEED_REGIONS = {"us-east-1":"us-east", "us-west-1":"us-west", "eu-west-1":"eu-ireland", "ap-southeast-1":"apac-sin",
+                     "ap-southeast-2":"apac-syd", "ap-northeast-1":"apac-tokyo"}
+
+_spot_price_cache = {}
+_spot_price_lock = threading.Lock()
+
+def _parse_spot_feed(data):
+    '''
+        Utility function to parse the spot price feed (JSONP as served at SPOT_PRICE_URL, or plain JSON) into an index.
+
+        OUTPUT:
+            A dict mapping (region, instance type) to the current spot price in USD (float). Instance types without a
+            price are left out.
+    '''
+    data = data.strip()
+    if not data.startswith("{"):
+        data = data[data.index("(") + 1:data.rindex(")")]
+    data = json.loads(data)
+    index = {}
+    for region in data["config"]["regions"]:
+        for instances in region["instanceTypes"]:
+            for instance in instances["sizes"]:
+                try:
+                    index[(region["region"], instance["size"])] = float(instance["valueColumns"][0]["prices"]["USD"])
+                except (ValueError, KeyError, IndexError):
+                    pass
+    return index
+
+def _load_spot_prices(source):
+    '''
+        Utility function to fetch and index spot prices from a source, which can be a URL, a local path to a copy of
+        the feed, or a function returning the index directly.
+    '''
+    if callable(source):
+        return source()
+    if source.startswith("http://") or source.startswith("https://"):
+        import requests
+        return _parse_spot_feed(requests.get(source, params={"callback":"callback", "_":str(int(time.time()))}).text)
+    with open(source) as f:
+        return _parse_spot_feed(f.read())
+
+# Containers run at a time by each instance type, used to size clusters from their input. Taken as the number of
+# vCPUs of the instance.
+INSTANCE_SLOTS = {"m3.xlarge":4, "m3.2xlarge":8, "m4.xlarge":4, "m4.2xlarge":8, "m4.4xlarge":16, "m5.xlarge":4,
+                  "m5.2xlarge":8, "m5.4xlarge":16, "c3.xlarge":4, "c3.2xlarge":8, "c4.xlarge":4, "c4.2xlarge":8,
+                  "c5.xlarge":4, "c5.2xlarge":8, "c5.4xlarge":16, "r3.xlarge":4, "r3.2xlarge":8, "r4.xlarge":4,
+                  "r4.2xlarge":8, "r5.xlarge":4, "r5.2xlarge":8, "r5.4xlarge":16}
+
+ACTIVE_CLUSTER_STATES = ["STARTING","BOOTSTRAPPING","RUNNING","WAITING","TERMINATING"]
+TERMINAL_CLUSTER_STATES = ["TERMINATED","TERMINATED_WITH_ERRORS"]
+TERMINAL_STEP_STATES = ["COMPLETED","CANCELLED","FAILED","INTERRUPTED"]
+POOL_TAG = "boto3_utils:pool"
 
 class AwsEmrHelper:
-    def __init__(self,AWS_ACCESS_KEY_ID,AWS_SECRET_ACCESS_KEY,region_name="ap-southeast-1",):
+    def __init__(self,AWS_ACCESS_KEY_ID,AWS_SECRET_ACCESS_KEY,region_name="ap-southeast-1",max_pool_connections=50):
         '''
             Method to create a cluster on EMR and run a jobflow on it.
 
@@ -156,19 +1912,41 @@ class AwsEmrHelper:
                 AWS_ACCESS_KEY_ID (string): Access Key associated with an AWS account.
                 AWS_SECRET_ACCESS_KEY (string): Corresponding Secret Key associated to the account.
                 (OPTIONAL) region_name (string): Region for the account. Set default to 'ap-southeast-1'. 
+                (OPTIONAL) max_pool_connections (int): size of the connection pool of the shared clients. Default is 50.
         '''
 
-        self.conn_s3 = AwsS3Helper(AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY)
-        self.conn_emr = boto3.client("emr", region_name = region_name, aws_access_key_id = AWS_ACCESS_KEY_ID, \
-            aws_secret_access_key = AWS_SECRET_ACCESS_KEY)
+        self.conn_s3 = AwsS3Helper(AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, region_name=region_name, max_pool_connections=max_pool_connections)
+        self._conn_emr = None
         self.config_bootstrapper = []
         self.s3n = "s3n://"
         self.instance_list = []
         self.steps= []
+        self.local_steps = []
+        self.cluster_plan = None
+        self.manifest_path = DEFAULT_MANIFEST_PATH
+        self.archive_dir = DEFAULT_ARCHIVE_DIR
+        self.region_name = region_name
+        self.spot_price_source = SPOT_PRICE_URL
+        self.spot_price_ttl = 300
+        self.spot_price_cache_path = None
+
+    @property
+    def conn_emr(self):
+        '''
+            Shared EMR client, created on first use so that helpers are cheap to create.
+        '''
+        if self._conn_emr is None:
+            self._conn_emr = get_client("emr", self.region_name, self.conn_s3.credentials[0], self.conn_s3.credentials[1],
+                                        self.conn_s3.max_pool_connections)
+        return self._conn_emr
+
+    @conn_emr.setter
+    def conn_emr(self, conn_emr):
+        self._conn_emr = conn_emr
 
     def get_spot_price(self,instance_dict):
         '''
-            Utility function to get bidprice for an instance type. If no bid multiplier is mentioned, 1.5 is taken as the default multiplier.
+            Utility function to get bidprice for an instance type in the helper's region. If no bid multiplier is mentioned, 1.5 is taken as the default multiplier. Spot prices are looked up in the cached index returned by get_spot_prices.
 
             PARAMETERS: 
                 instance_dict (dictionary): Dictionary containing bid multiplier and instance type. The value of 'Market' key in instance_dict should be set to 'SPOT'.
@@ -185,21 +1963,8 @@ class AwsEmrHelper:
                 bid_multiplier = instance_dict["bid_multiplier"]
             else:
                 bid_multiplier = 1.5
-            current_epoch = str(int(time.time()))
-            url = "https://spot-price.s3.amazonaws.com/spot.js?callback=callback&_=" + current_epoch
-            r = requests.get(url)
-            data = r.text
-            data = data.replace("callback(","")
-            data = data.replace(")","")
-            data = data.replace(";","")
-            data = json.loads(data)
-            result = None
-            for region in data["config"]["regions"]:
-                if region["region"] == "apac-sin":
-                    for instances in region["instanceTypes"]:
-                        for instance in instances["sizes"]:
-                            if instance["size"] == instance_dict["instance_type"]:
-                                result = float(instance["valueColumns"][0]["prices"]["USD"])
+            region = SPOT_FEED_REGIONS.get(self.region_name, self.region_name)
+            result = self.get_spot_prices().get((region, instance_dict["instance_type"]))
 
             if not result:
                 raise ValueError("The specified instance type doesn't exist or is not available for spot use.")
@@ -207,9 +1972,47 @@ class AwsEmrHelper:
         else:
             return None
 
+    def get_spot_prices(self):
+        '''
+            Utility function to get current spot prices of all regions and instance types. Prices are fetched from
+            spot_price_source (by default the public spot price feed; can also be set to a local copy of the feed or to a
+            function returning the index) and kept in an in-process cache shared by all helpers for spot_price_ttl seconds.
+            If spot_price_cache_path is set, prices are also cached on disk at that path for the same duration.
+
+            PARAMETERS: None
+
+            OUTPUT:
+                A dict mapping (feed region, instance type) to the spot price in USD (float).
+
+            USAGE:
+                conn_emr.spot_price_source = '/home/abc/spot.js'
+                prices = conn_emr.get_spot_prices()
+        '''
+        cache_key = self.spot_price_source if not callable(self.spot_price_source) else id(self.spot_price_source)
+        with _spot_price_lock:
+            cached = _spot_price_cache.get(cache_key)
+            if cached and time.time() - cached[0] < self.spot_price_ttl:
+                return cached[1]
+
+            index = None
+            cache_path = self.spot_price_cache_path
+            if cache_path and os.path.exists(cache_path) and time.time() - os.path.getmtime(cache_path) < self.spot_price_ttl:
+                try:
+                    with open(cache_path) as f:
+                        index = dict(((region, size), price) for region, size, price in json.load(f))
+                except (IOError, ValueError):
+                    index = None
+            if index is None:
+                index = _load_spot_prices(self.spot_price_source)
+                if cache_path:
+                    _save_json(cache_path, [[region, size, price] for (region, size), price in index.items()])
+            _spot_price_cache[cache_key] = (time.time(), index)
+            return index
+
     def clear_s3_folder(self,s3_path):
         '''
-            Utility function to delete a s3 path and it's subpaths.
+            Utility function to delete a s3 path and it's subpaths. Keys are deleted in batches of up to 1000 while the
+            path is still being listed.
 
             PARAMETERS:
                 s3_path (string): s3 path to be cleared.
@@ -219,9 +2022,9 @@ class AwsEmrHelper:
             USAGE:
                 clear_s3_folder('s3_bucket/some_path/')
         '''
-        file_keys = self.conn_s3.list_keys(s3_path)
-        for fkey in file_keys:
-            self.conn_s3.del_file(fkey)
+        failed = self.conn_s3.delete_prefix(s3_path)
+        if len(failed) != 0:
+            raise IOError("Failed to delete %d objects under %s, e.g. %s: %s" % (len(failed), s3_path, failed[0]["path"], failed[0]["message"]))
 
     def set_input_path(self, input_path):
         '''
@@ -243,6 +2046,42 @@ class AwsEmrHelper:
         else:
             self.input_path = self.s3n + input_path
 
+    def compact_input(self, input_path, compact_path, **kwargs):
+        '''
+            Utility function to concatenate the small objects of input paths into blocks under compact_path with
+            AwsS3Helper.compact_prefix, so that a job reading them starts one map task per block instead of one per
+            object. compact_path is cleared first. Keyword arguments (e.g. block_size, compress) are passed to
+            compact_prefix.
+
+            PARAMETERS:
+                input_path (string or list, in case of multiple inputs): s3 path of input files
+                compact_path (string): s3 path where blocks are written, outside of the input paths. Multiple inputs are written to numbered sub-paths.
+
+            OUTPUT:
+                The compacted input path(s), in the form of input_path, to be passed to add_job_step.
+
+            USAGE:
+                input_path = compact_input('s3_bucket/raw_events/','s3_bucket/compacted/',block_size=256*1024**2)
+        '''
+        paths = input_path if isinstance(input_path,list) else [input_path]
+        if len(paths) == 0:
+            raise ValueError("Length of input list is 0.")
+        compact_path = compact_path.rstrip("/") + "/"
+        for path in paths:
+            path = path.rstrip("/") + "/"
+            if path.startswith(compact_path) or compact_path.startswith(path):
+                raise ValueError("compact_path %s and input path %s can't contain one another." % (compact_path, path))
+        self.clear_s3_folder(compact_path)
+        compacted = []
+        for i, path in enumerate(paths):
+            dst_path = compact_path + "%05d/" % i if isinstance(input_path,list) else compact_path
+            report = self.conn_s3.compact_prefix(path, dst_path, **kwargs)
+            if len(report["failed"]) != 0:
+                failed = report["failed"][0]
+                raise IOError("Failed to compact %d blocks of %s, e.g. %s: %s" % (len(report["failed"]), path, failed["dst_path"], failed["message"]))
+            compacted.append(dst_path)
+        return compacted if isinstance(input_path,list) else compacted[0]
+
     def set_output_path(self, output_path, del_existing_path):
         '''
             Utility function to set path for job output. Note: This path shouldn't exist before the starting the job. Setting del_existing_path to True will delete the output path if it exists.
@@ -283,12 +2122,14 @@ class AwsEmrHelper:
         bootstrap_action = {"Name":bootstrap_title, "ScriptBootstrapAction":{"Path":"s3://" + bootstrap_path, "Args":bootstrap_params}}
         self.config_bootstrapper.append(bootstrap_action)
 
-    def set_mapper_loc(self, mapper_loc, mapper_fname):
+    def set_mapper_loc(self, mapper_loc, mapper_fname, upload=True):
         '''
-            Utility to upload mapper source file and set it's s3 path.
+            Utility to upload mapper source file and set it's s3 path. The file is only uploaded if it differs from the
+            object already at mapper_loc.
             PARAMETERS:
                 mapper_loc (string): s3 path to upload mapper source file.
                 mapper_fname (string): local path of mapper source file.
+                (OPTIONAL) upload (bool): Flag to upload the source file. Set to False if it is uploaded separately.
 
             OUPTUT: None
 
@@ -298,15 +2139,18 @@ class AwsEmrHelper:
         '''
         if not os.path.exists(mapper_fname):
             raise IOError("Mapper doesn't exist at the specified location.")
-        self.conn_s3.upload_file(mapper_loc,mapper_fname)
+        if upload:
+            self.conn_s3.upload_changed([(mapper_loc,mapper_fname)], manifest_path=self.manifest_path)
         self.mapper_loc = self.s3n + mapper_loc
 
-    def set_reducer_loc(self, reducer_loc, reducer_fname):
+    def set_reducer_loc(self, reducer_loc, reducer_fname, upload=True):
         '''
-            Utility to upload reducer source file and set it's s3 path.
+            Utility to upload reducer source file and set it's s3 path. The file is only uploaded if it differs from the
+            object already at reducer_loc.
             PARAMETERS:
                 reducer_loc (string): s3 path to upload reducer source file.
                 reducer_fname (string): local path of reducer source file.
+                (OPTIONAL) upload (bool): Flag to upload the source file. Set to False if it is uploaded separately.
 
             OUPTUT: None
 
@@ -316,7 +2160,8 @@ class AwsEmrHelper:
         '''
         if not os.path.exists(reducer_fname):
             raise IOError("Reducer doesn't exist at the specified location.")
-        self.conn_s3.upload_file(reducer_loc,reducer_fname)
+        if upload:
+            self.conn_s3.upload_changed([(reducer_loc,reducer_fname)], manifest_path=self.manifest_path)
         self.reducer_loc = self.s3n + reducer_loc
 
     def get_debugging_step(self):
@@ -338,8 +2183,57 @@ class AwsEmrHelper:
                 }
             }
 
+    def build_archive(self, fnames):
+        '''
+            Utility function to pack local files into a compressed tar archive named by the md5 of its content, in
+            archive_dir. The archive is built deterministically, so identical files always give the same archive, and
+            it is only rebuilt when the size or mtime of one of the files changes.
+
+            PARAMETERS:
+                fnames (list): local paths of files to be packed. Files are stored under their base name.
+
+            OUTPUT:
+                local path of the archive (string)
+
+            USAGE:
+                build_archive(['/home/xyz/map.py','/home/xyz/dict.p'])
+        '''
+        names = [os.path.basename(fname) for fname in fnames]
+        if len(set(names)) != len(names):
+            raise ValueError("Files packed in an archive must have distinct names.")
+        manifest = _load_manifest(self.manifest_path)
+        inputs = sorted([os.path.abspath(fname), os.path.getsize(fname), os.path.getmtime(fname)] for fname in fnames)
+        inputs_key = "archive:" + hashlib.sha1(json.dumps(inputs).encode("utf-8")).hexdigest()
+        if inputs_key in manifest and os.path.exists(manifest[inputs_key]["path"]):
+            return manifest[inputs_key]["path"]
+
+        if not os.path.isdir(self.archive_dir):
+            os.makedirs(self.archive_dir)
+        fd, tmp_path = tempfile.mkstemp(dir=self.archive_dir)
+        with os.fdopen(fd, "wb") as raw:
+            compressed = gzip.GzipFile(filename="", mode="wb", fileobj=raw, mtime=0)
+            tar = tarfile.open(fileobj=compressed, mode="w")
+            for fname in sorted(fnames, key=os.path.basename):
+                info = tar.gettarinfo(fname, arcname=os.path.basename(fname))
+                info.mtime = 0
+                info.uid = info.gid = 0
+                info.uname = info.gname = ""
+                info.mode = 0o755 if info.mode & 0o100 else 0o644
+                with open(fname, "rb") as f:
+                    tar.addfile(info, f)
+            tar.close()
+            compressed.close()
+        archive_path = os.path.join(self.archive_dir, "artifacts-%s.tgz" % _file_md5(tmp_path)[:16])
+        if os.name == "nt" and os.path.exists(archive_path):
+            os.remove(archive_path)
+        os.rename(tmp_path, archive_path)
+        manifest[inputs_key] = {"path":archive_path}
+        _save_json(self.manifest_path, manifest)
+        return archive_path
+
     def add_job_step(self, step_name, input_path, output_path, mapper_path, mapper_fname, reducer_path=None, 
-                    reducer_fname=None, del_existing_path=False, cache_files=[], cache_loc=None, additional_args=[]):
+                    reducer_fname=None, del_existing_path=False, cache_files=[], cache_loc=None, additional_args=[],
+                    archive=False, archive_name="artifacts", compact_path=None):
         '''
             Function to add steps to a job flow. All steps needs to be added before job flow starts.
 
@@ -353,8 +2247,11 @@ class AwsEmrHelper:
                 (OPTIONAL) reducer_fname (string): local path of reducer source file
                 (OPTIONAL) del_exisitng_path (bool): Flag to clear output s3 path if it exists. Default is set to False. Set to True to clear s3 path if it exists.
                 (OPTIONAL) cache_files (list): list of cache files to be provided during runtime. If cache_loc is not provided, then cache_files need to be a list of s3 paths. If cache_loc is provided, then cache_files should be a list of local paths.
-                (OPTIONAL) cache_loc (string): s3 path where cache files to be uploaded.
-		(OPTIONAL) additional_args: additional arguments to be passed to hadoop execution.
+                (OPTIONAL) cache_loc (string): s3 path where cache files to be uploaded. Cache files, mapper and reducer are uploaded in parallel, skipping the ones unchanged since their last upload.
+                (OPTIONAL) additional_args: additional arguments to be passed to hadoop execution.
+                (OPTIONAL) archive (bool): Flag to pack the local cache files, mapper and reducer into a single compressed archive, uploaded once to cache_loc (or next to mapper_path) and passed with -archives. The archive is named by its content hash, so it is reused by other steps with the same files. On the nodes, the files are under the archive_name directory and mapper and reducer run as 'python2.7 archive_name/map.py'. Default is set to False.
+                (OPTIONAL) archive_name (string): name of the directory the archive is unpacked to on the nodes. Default is 'artifacts'.
+                (OPTIONAL) compact_path (string): s3 path where the small objects of input_path are concatenated into 128 MB blocks before the step is added, with compact_input. The step then reads the blocks. Default is None, reading input_path as it is.
 
             OUTPUT: None
 
@@ -363,39 +2260,71 @@ class AwsEmrHelper:
                     reducer_path='s3_bucket/src_path/reduce.py',reducer_fname='/home/xyz/map.py',del_existing_path=True,
                     cache_files=['/home/xyz/dict.p'],cache_loc='s3_bucket/src_path/')
         '''
+        local_step = {"name":step_name, "input_path":input_path if isinstance(input_path,list) else [input_path],
+                      "output_path":output_path, "mapper":mapper_fname, "reducer":reducer_fname if reducer_path else None,
+                      "cache_files":list(cache_files), "local_cache_files":bool(cache_loc), "additional_args":list(additional_args)}
         files = []
+        uploads = []
+        packed = []
         if len(cache_files) != 0:
             if cache_loc:
                 for path in cache_files:
                     fname = path.split("/")[-1]
-                    self.conn_s3.upload_file(cache_loc + fname, path)
+                    if archive:
+                        packed.append(path)
+                        continue
+                    uploads.append((cache_loc + fname, path))
                     files.append(self.s3n + cache_loc + fname + "#" + fname)
             else:
                 cache_files = map(lambda x: self.s3n + x + "#" + x.split("/")[-1],cache_files)
                 files.extend(cache_files)
 
         self.reducer_loc = None
+        if compact_path:
+            input_path = self.compact_input(input_path, compact_path)
         self.set_input_path(input_path)
         self.set_output_path(output_path,del_existing_path)
-        self.set_mapper_loc(mapper_path, mapper_fname)
+        self.set_mapper_loc(mapper_path, mapper_fname, upload=False)
+        if archive:
+            packed.append(mapper_fname)
+        else:
+            uploads.append((mapper_path, mapper_fname))
         mapper_fname = mapper_fname.split("/")[-1]
-        files.append(self.s3n + mapper_path + "#" + mapper_fname)
+        if not archive:
+            files.append(self.s3n + mapper_path + "#" + mapper_fname)
 
         if reducer_path and reducer_fname:
-            self.set_reducer_loc(reducer_path, reducer_fname)
+            self.set_reducer_loc(reducer_path, reducer_fname, upload=False)
+            if archive:
+                packed.append(reducer_fname)
+            else:
+                uploads.append((reducer_path, reducer_fname))
             reducer_fname = reducer_fname.split("/")[-1]
-            files.append(self.s3n + reducer_path + "#" + reducer_fname)
-
-        args = ["hadoop-streaming",
-                 "-files", ",".join(files),
-                 "-mapper", "python2.7 " + mapper_fname,
-                 "-input", self.input_path,
-                 "-output", self.output_path]
+            if not archive:
+                files.append(self.s3n + reducer_path + "#" + reducer_fname)
+
+        command_dir = ""
+        if archive:
+            archive_fname = self.build_archive(packed)
+            archive_loc = (cache_loc or mapper_path[:mapper_path.rindex("/") + 1]) + os.path.basename(archive_fname)
+            uploads.append((archive_loc, archive_fname))
+            command_dir = archive_name + "/"
+
+        self.conn_s3.upload_changed(uploads, manifest_path=self.manifest_path)
+
+        args = ["hadoop-streaming"]
+        if len(files) != 0:
+            args.extend(["-files", ",".join(files)])
+        if archive:
+            args.extend(["-archives", self.s3n + archive_loc + "#" + archive_name])
+        args.extend(["-mapper", "python2.7 " + command_dir + mapper_fname,
+                     "-input", self.input_path,
+                     "-output", self.output_path])
 
         if reducer_path and reducer_fname:
-            args.extend(["-reducer","python2.7 " + reducer_fname])
-	
-	args.extend(additional_args)
+            args.extend(["-reducer","python2.7 " + command_dir + reducer_fname])
+
+        args.extend(additional_args)
 
         step_dict = {
                     "Name": step_name,
@@ -405,10 +2334,13 @@ class AwsEmrHelper:
                     "ActionOnFailure":"TERMINATE_JOB_FLOW"
         }
         self.steps.append(step_dict)
+        self.local_steps.append(local_step)
 
-    def add_instance(self, instance_dict):
+    def add_instance(self, instance_dict, deadline=None, **kwargs):
         '''
-            Function to add instances to cluster
+            Function to add instances to cluster. CORE and TASK instances can be sized from the input of the steps added
+            so far by setting their num_instances to 'auto' and passing a deadline; see plan_instances for the other
+            keyword arguments. The chosen plan is printed for review and kept in cluster_plan before run_job is called.
 
             PARAMETERS: instance_dict (dictionary): Dictionary containing instance parameters. The dictionary should only have three keys i.e. MASTER, CORE and TASK. These three keys are the instance roles specified to the cluster. Example of an instance dictionary:
 
@@ -419,12 +2351,24 @@ class AwsEmrHelper:
                     market (string): Only two options - ON_DEMAND or SPOT. 
                     name (string): Name for role instances
                     bid_multiplier (float): Only applicable if market is set to SPOT. Multiplies spot instances rate by this multiplier to get bid price.
+            (OPTIONAL) deadline (int): seconds the map phases of all steps should be done in, for roles sized automatically.
 
             RETURNS: None
 
             USAGE:
                 add_instance(instance_dict)
+                add_instance({"MASTER":{...},"CORE":{"instance_type":"auto","num_instances":"auto","market":"SPOT","name":"Worker Nodes"}}, deadline=3600)
         '''
+        if any(params["num_instances"] == "auto" for params in instance_dict.values()):
+            if deadline is None:
+                raise ValueError("A deadline is needed to size instances automatically.")
+            self.cluster_plan = self.plan_instances(instance_dict, deadline, **kwargs)
+            instance_dict = self.cluster_plan["instance_dict"]
+            print("Cluster plan : %s x %s, %d slots for %d map tasks (%d bytes), ~%ds, ~%.2f USD%s" % (
+                " + ".join("%d %s" % (count, role) for role, count in sorted(self.cluster_plan["instances"].items())),
+                self.cluster_plan["instance_type"], self.cluster_plan["slots"], self.cluster_plan["map_tasks"],
+                self.cluster_plan["input_bytes"], self.cluster_plan["estimated_seconds"], self.cluster_plan["estimated_cost"],
+                "" if self.cluster_plan["meets_deadline"] else ", deadline not met"))
         if "MASTER" not in instance_dict or "CORE" not in instance_dict:
             raise ValueError("Master and Core nodes not defined in instance dictionary.")
         for key in instance_dict:
@@ -440,7 +2384,153 @@ class AwsEmrHelper:
                 role_dict["BidPrice"] = self.get_spot_price(instance_dict[key])
             self.instance_list.append(role_dict)
 
-    def run_job(self, cluster_name, log_path, tags_list=None, ami_version=None, release_label=None, enable_debugging=False):
+    def get_step_inputs(self, bytes_per_task=128*1024**2):
+        '''
+            Utility function to get the size of the input of each step added so far, from the listing of its input
+            paths, and the number of map tasks hadoop will run over it: one per bytes_per_task bytes of each object,
+            or one per object for gzip objects, which can't be split. Objects starting with '_' or '.' are left out.
+            Inputs that don't exist yet (e.g. written by an earlier step) count as empty.
+
+            PARAMETERS:
+                (OPTIONAL) bytes_per_task (int): input bytes read by each map task. Default is 128 MB.
+
+            OUTPUT:
+                A list of dicts with keys 'name', 'bytes' and 'map_tasks', one per step.
+
+            USAGE:
+                conn_emr.get_step_inputs()
+        '''
+        inputs = {}
+        steps = []
+        for step in self.steps:
+            args = step["HadoopJarStep"]["Args"]
+            if "-input" not in args:
+                continue
+            step_input = {"name":step["Name"], "bytes":0, "map_tasks":0}
+            for path in args[args.index("-input") + 1].split(","):
+                if path.startswith(self.s3n):
+                    path = path[len(self.s3n):]
+                if path not in inputs:
+                    size, tasks = 0, 0
+                    for entry in self.conn_s3.iter_keys(path, parallel=True):
+                        fname = entry["path"].split("/")[-1]
+                        if entry["size"] == 0 or fname.startswith(("_", ".")):
+                            continue
+                        size += entry["size"]
+                        tasks += 1 if fname.endswith(".gz") else -(-entry["size"]//bytes_per_task)
+                    inputs[path] = (size, tasks)
+                step_input["bytes"] += inputs[path][0]
+                step_input["map_tasks"] += inputs[path][1]
+            steps.append(step_input)
+        return steps
+
+    def plan_instances(self, instance_dict, deadline, bytes_per_task=128*1024**2, task_seconds=120, instance_slots=None,
+                       on_demand_prices=None, max_instances=100):
+        '''
+            Function to size the CORE and TASK instances of a cluster from the input of the steps added so far. Roles
+            with num_instances set to 'auto' get the instance type and count that run the map tasks of all steps
+            (see get_step_inputs) within deadline seconds at the lowest cost. The map phase of each step is taken to
+            run in waves of task_seconds, one task per container slot. Spot instances are priced at the cached spot
+            price (see get_spot_prices), on-demand instances at on_demand_prices. If no plan meets the deadline, the
+            fastest one is chosen.
+
+            When both CORE and TASK are 'auto', CORE keeps its min_instances and TASK is scaled. Roles can restrict the
+            instance types tried with a list in instance_type, and set min_instances and max_instances.
+
+            PARAMETERS:
+                instance_dict (dictionary): Dictionary containing instance parameters, as for add_instance. Example:
+
+                    instance_dict = {"MASTER":{"instance_type":"m3.xlarge","num_instances":1,"market":"ON_DEMAND","name":"Main Nodes"},"CORE":{"instance_type":["m5.xlarge","c5.xlarge"],"num_instances":"auto","market":"SPOT","name":"Worker Nodes"}}
+
+                deadline (int): seconds the map phases of all steps should be done in.
+                (OPTIONAL) bytes_per_task (int): input bytes read by each map task. Default is 128 MB.
+                (OPTIONAL) task_seconds (int): seconds taken by a map task. Default is 120.
+                (OPTIONAL) instance_slots (dict): container slots of each instance type. Default is INSTANCE_SLOTS.
+                (OPTIONAL) on_demand_prices (dict): hourly price in USD of each on-demand instance type. Instance types without a price can't be picked for on-demand roles. Default is None.
+                (OPTIONAL) max_instances (int): largest number of instances of a role. Default is 100.
+
+            OUTPUT:
+                A dict with keys 'instance_dict' (instance_dict with the chosen types and counts), 'instance_type',
+                'instances' (count of each role sized), 'slots', 'steps' (as returned by get_step_inputs),
+                'input_bytes', 'map_tasks', 'estimated_seconds', 'estimated_cost' (USD), 'deadline' and
+                'meets_deadline'.
+
+            USAGE:
+                plan = conn_emr.plan_instances(instance_dict, 3600)
+        '''
+        if len(self.steps) == 0:
+            raise ValueError("No steps added to the job.")
+        auto = [role for role in ["CORE","TASK"] if role in instance_dict and instance_dict[role]["num_instances"] == "auto"]
+        if len(auto) == 0:
+            raise ValueError("No instances to be sized. Set num_instances of CORE or TASK to 'auto'.")
+        instance_slots = instance_slots or INSTANCE_SLOTS
+        on_demand_prices = on_demand_prices or {}
+        spot_prices = self.get_spot_prices()
+        region = SPOT_FEED_REGIONS.get(self.region_name, self.region_name)
+
+        def price(instance_type, market):
+            if market == "SPOT":
+                return spot_prices.get((region, instance_type))
+            return on_demand_prices.get(instance_type)
+
+        fixed_slots = 0
+        fixed_price = 0.0
+        for role, params in instance_dict.items():
+            if role in auto:
+                continue
+            fixed_price += (price(params["instance_type"], params["market"]) or 0.0)*params["num_instances"]
+            if role != "MASTER":
+                fixed_slots += instance_slots.get(params["instance_type"], 0)*params["num_instances"]
+
+        candidates = None
+        for role in auto:
+            instance_types = instance_dict[role].get("instance_type", "auto")
+            if instance_types == "auto":
+                instance_types = instance_slots.keys()
+            elif not isinstance(instance_types, list):
+                instance_types = [instance_types]
+            instance_types = set(t for t in instance_types if t in instance_slots and price(t, instance_dict[role]["market"]) is not None)
+            candidates = instance_types if candidates is None else candidates & instance_types
+        if not candidates:
+            raise ValueError("None of the instance types to be sized has a known price and number of slots.")
+
+        steps = self.get_step_inputs(bytes_per_task)
+        scaled = auto[-1]
+        counts = dict((role, instance_dict[role].get("min_instances", 1)) for role in auto)
+        options = []
+        for instance_type in sorted(candidates):
+            for count in range(instance_dict[scaled].get("min_instances", 1 if scaled == "CORE" else 0),
+                               instance_dict[scaled].get("max_instances", max_instances) + 1):
+                counts[scaled] = count
+                slots = fixed_slots + sum(counts.values())*instance_slots[instance_type]
+                if slots == 0:
+                    continue
+                seconds = sum(-(-step["map_tasks"]//slots)*task_seconds for step in steps)
+                hourly_price = fixed_price + sum(price(instance_type, instance_dict[role]["market"])*counts[role] for role in auto)
+                options.append({"instance_type":instance_type, "instances":dict(counts), "slots":slots,
+                                "estimated_seconds":seconds, "estimated_cost":round(hourly_price*seconds/3600.0, 4)})
+        feasible = [option for option in options if option["estimated_seconds"] <= deadline]
+        if feasible:
+            plan = min(feasible, key=lambda x:(x["estimated_cost"], x["estimated_seconds"]))
+        else:
+            plan = min(options, key=lambda x:(x["estimated_seconds"], x["estimated_cost"]))
+
+        sized = {}
+        for role, params in instance_dict.items():
+            params = dict(params)
+            if role in auto:
+                if plan["instances"][role] == 0:
+                    continue
+                params["instance_type"] = plan["instance_type"]
+                params["num_instances"] = plan["instances"][role]
+            sized[role] = params
+        plan.update({"instance_dict":sized, "steps":steps, "input_bytes":sum(step["bytes"] for step in steps),
+                     "map_tasks":sum(step["map_tasks"] for step in steps), "deadline":deadline,
+                     "meets_deadline":bool(feasible)})
+        return plan
+
+    def run_job(self, cluster_name, log_path, tags_list=None, ami_version=None, release_label=None, enable_debugging=False,
+                keep_alive=False, idle_timeout=None):
         '''
             Function to start job flow.
 
@@ -451,6 +2541,8 @@ class AwsEmrHelper:
                 ami_version (string): AMI version to be used. Should be used only for EMR 3 and below. At least one of ami_version or release_label should be specified.
                 release_label (string): To be used for EMR 4 and above.
                 enable_debugging (boolean): Flag to enable debugging. BY default set to False. 
+                (OPTIONAL) keep_alive (bool): Flag to keep the cluster running once all steps are done. Default is set to False.
+                (OPTIONAL) idle_timeout (int): seconds after which an idle cluster kept alive terminates itself (EMR 5.30 and above). Default is None.
 
             OUTPUT: None
 
@@ -465,20 +2557,25 @@ class AwsEmrHelper:
             raise ValueError("No steps added to the job.")
         if not release_label and not ami_version:
             raise ValueError("Must specify either release label or ami version")
+        instances = {"InstanceGroups":self.instance_list, "KeepJobFlowAliveWhenNoSteps":keep_alive}
+        extra_args = {}
+        if idle_timeout:
+            extra_args["AutoTerminationPolicy"] = {"IdleTimeout":idle_timeout}
         if release_label:
             cluster_id = self.conn_emr.run_job_flow(Name=cluster_name,
                                      ReleaseLabel=release_label,
-                                     Instances={"InstanceGroups":self.instance_list},
+                                     Instances=instances,
                                      LogUri=self.s3n + log_path,
                                      Steps=self.steps,
                                      BootstrapActions=self.config_bootstrapper,
                                      VisibleToAllUsers=True,
                                      JobFlowRole="EMR_EC2_DefaultRole",
                                      ServiceRole="EMR_DefaultRole",
-                                     Tags=tags_list)
+                                     Tags=tags_list or [],
+                                     **extra_args)
         if ami_version:
             cluster_id = self.conn_emr.run_job_flow(Name=cluster_name,
-                                     Instances={"InstanceGroups":self.instance_list},
+                                     Instances=instances,
                                      LogUri=self.s3n + log_path,
                                      Steps=self.steps,
                                      AmiVersion=ami_version,
@@ -486,11 +2583,11 @@ class AwsEmrHelper:
                                      VisibleToAllUsers=True,
                                      JobFlowRole="EMR_EC2_DefaultRole",
                                      ServiceRole="EMR_DefaultRole",
-                                     Tags=tags_list)
-
+                                     Tags=tags_list or [],
+                                     **extra_args)
 
         self.job_id = cluster_id["JobFlowId"]
-        print "JobId is : " + self.job_id
+        print("JobId is : " + self.job_id)
 
     def get_cluster_status(self):
         '''
@@ -506,5 +2603,432 @@ class AwsEmrHelper:
         jobstate = status['Cluster']['Status']['State']
         return jobstate
 
+    def iter_cluster_events(self, job_ids=None, steps=True, min_delay=5, max_delay=60, timeout=None, step_ids=None):
+        '''
+            Generator of state transitions of clusters and their steps, until all clusters have terminated. States of all
+            active clusters are fetched with one (paginated) list_clusters call per poll, falling back to describe_cluster
+            only for clusters not listed as active; step states come from list_steps, called only for clusters that are
+            RUNNING or WAITING or whose state just changed. Polling starts every min_delay
+            seconds and backs off up to max_delay seconds while nothing changes.
+
+            PARAMETERS:
+                (OPTIONAL) job_ids (list): ids of clusters to watch. Default is the cluster started by run_job.
+                (OPTIONAL) steps (bool): Flag to also report step transitions. Default is set to True.
+                (OPTIONAL) min_delay (int): seconds between polls after a transition. Default is 5.
+                (OPTIONAL) max_delay (int): maximum seconds between polls. Default is 60.
+                (OPTIONAL) timeout (int): seconds after which RuntimeError is raised if clusters are still active. Default is None (no timeout).
+                (OPTIONAL) step_ids (list): ids of steps to wait for. If given, the generator ends once these steps have
+                    finished instead of when the clusters terminate, e.g. for steps submitted with run_job_in_pool.
+
+            OUTPUT:
+                Yields dicts with keys 'job_id', 'step_id' (None for cluster transitions), 'name', 'state',
+                'previous_state' (None when first seen) and 'message' (reason of the last state change, if any).
+
+            USAGE:
+                for event in iter_cluster_events():
+                    print(event['job_id'], event['name'], event['state'])
+        '''
+        job_ids = list(job_ids) if job_ids else [self.job_id]
+        states = {}
+        step_states = {}
+        delay = min_delay
+        start = time.time()
+        while True:
+            events = []
+            active = {}
+            for page in self.conn_emr.get_paginator("list_clusters").paginate(ClusterStates=ACTIVE_CLUSTER_STATES):
+                for cluster in page["Clusters"]:
+                    if cluster["Id"] in job_ids:
+                        active[cluster["Id"]] = cluster
+            for job_id in job_ids:
+                if states.get(job_id) in TERMINAL_CLUSTER_STATES:
+                    continue
+                cluster = active.get(job_id)
+                if cluster is None:
+                    cluster = self.conn_emr.describe_cluster(ClusterId=job_id)["Cluster"]
+                state = cluster["Status"]["State"]
+                # Steps only change on running clusters, or around a cluster transition (e.g. cancelled on termination).
+                if (steps or step_ids) and (state in ["RUNNING","WAITING"] or state != states.get(job_id)):
+                    for page in self.conn_emr.get_paginator("list_steps").paginate(ClusterId=job_id):
+                        for step in reversed(page["Steps"]):
+                            previous = step_states.get(step["Id"])
+                            if step["Status"]["State"] != previous:
+                                step_states[step["Id"]] = step["Status"]["State"]
+                                events.append({"job_id":job_id, "step_id":step["Id"], "name":step["Name"], "state":step["Status"]["State"],
+                                               "previous_state":previous, "message":step["Status"].get("StateChangeReason", {}).get("Message")})
+                previous = states.get(job_id)
+                if state != previous:
+                    states[job_id] = state
+                    events.append({"job_id":job_id, "step_id":None, "name":cluster["Name"], "state":state,
+                                   "previous_state":previous, "message":cluster["Status"].get("StateChangeReason", {}).get("Message")})
+            for event in events:
+                yield event
+            if all(states.get(job_id) in TERMINAL_CLUSTER_STATES for job_id in job_ids):
+                return
+            if step_ids and all(step_states.get(step_id) in TERMINAL_STEP_STATES for step_id in step_ids):
+                return
+            if timeout is not None and time.time() - start > timeout:
+                raise RuntimeError("Timed out waiting for clusters to terminate.")
+            delay = min_delay if len(events) != 0 else min(delay*1.5, max_delay)
+            time.sleep(delay)
+
+    def wait_for_cluster(self, job_ids=None, callback=None, **kwargs):
+        '''
+            Function to wait until clusters have terminated (or until step_ids have finished), calling callback on every
+            cluster and step transition. Accepts the same optional parameters as iter_cluster_events.
+
+            PARAMETERS:
+                (OPTIONAL) job_ids (list): ids of clusters to wait for. Default is the cluster started by run_job.
+                (OPTIONAL) callback (function): function called with each transition, as yielded by iter_cluster_events.
+
+            OUTPUT:
+                A dict mapping each job id to its final state, TERMINATED or TERMINATED_WITH_ERRORS.
+
+            USAGE:
+                final_states = wait_for_cluster(callback=log_event)
+        '''
+        states = {}
+        for event in self.iter_cluster_events(job_ids, **kwargs):
+            if event["step_id"] is None:
+                states[event["job_id"]] = event["state"]
+            if callback:
+                callback(event)
+        return states
+
+    def get_pool_key(self, ami_version=None, release_label=None):
+        '''
+            Utility function to get the key identifying the cluster pool matching the current instance and bootstrap
+            configuration. Bid prices are left out, so clusters stay matching when spot prices move.
+
+            OUTPUT:
+                pool_key (string)
+        '''
+        instances = [dict((k, v) for k, v in group.items() if k != "BidPrice") for group in self.instance_list]
+        config = {"instances":sorted(instances, key=lambda x:x["InstanceRole"]), "bootstrap":self.config_bootstrapper,
+                  "ami_version":ami_version, "release_label":release_label}
+        return hashlib.sha1(json.dumps(config, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+    def _pool_name_suffix(self, pool_key):
+        '''
+            Utility function to get the suffix of the names of the clusters of a pool.
+        '''
+        return " [pool %s]" % pool_key
+
+    def get_pool_clusters(self, pool_key):
+        '''
+            Function to get the running clusters of a cluster pool. Only clusters whose name ends with the pool's
+            suffix are described, so the cost doesn't grow with the number of other clusters in the account.
+
+            PARAMETERS:
+                pool_key (string): key of the pool, as returned by get_pool_key.
+
+            OUTPUT:
+                A list of dicts with keys 'job_id', 'state' and 'queue_depth' (number of pending or running steps).
+
+            USAGE:
+                get_pool_clusters(conn_emr.get_pool_key(release_label='emr-5.0.0'))
+        '''
+        clusters = []
+        name_suffix = self._pool_name_suffix(pool_key)
+        for page in self.conn_emr.get_paginator("list_clusters").paginate(ClusterStates=["STARTING","BOOTSTRAPPING","RUNNING","WAITING"]):
+            for summary in page["Clusters"]:
+                # Other clusters of the account are told apart by name, without a describe_cluster call each.
+                if not summary["Name"].endswith(name_suffix):
+                    continue
+                cluster = self.conn_emr.describe_cluster(ClusterId=summary["Id"])["Cluster"]
+                tags = dict((tag["Key"], tag["Value"]) for tag in cluster.get("Tags", []))
+                if tags.get(POOL_TAG) != pool_key:
+                    continue
+                queue_depth = 0
+                for steps in self.conn_emr.get_paginator("list_steps").paginate(ClusterId=summary["Id"], StepStates=["PENDING","RUNNING"]):
+                    queue_depth += len(steps["Steps"])
+                clusters.append({"job_id":summary["Id"], "state":cluster["Status"]["State"], "queue_depth":queue_depth})
+        return clusters
+
+    def run_job_in_pool(self, cluster_name, log_path, tags_list=None, ami_version=None, release_label=None, max_clusters=1,
+                        max_queue_depth=1, idle_timeout=3600):
+        '''
+            Function to run the added steps on a pool of long-running clusters instead of a new cluster. Pool clusters
+            are tagged with a key of the instance and bootstrap configuration. Steps are submitted to an idle matching
+            cluster if there is one. Otherwise a new cluster is launched into the pool if every matching cluster already
+            has max_queue_depth steps queued and the pool has fewer than max_clusters clusters, or else the steps are
+            queued on the least busy matching cluster. Pool clusters are kept alive between jobs and terminate
+            themselves after idle_timeout seconds without steps; see also scale_down_pool.
+
+            Steps run with ActionOnFailure set to CONTINUE, so a failed step doesn't terminate a pool cluster. Use
+            wait_for_cluster(step_ids=conn_emr.step_ids) to wait for the submitted steps.
+
+            PARAMETERS:
+                cluster_name (string): Name for a newly launched cluster, followed by ' [pool <pool_key>]'.
+                log_path (string): s3 path where logs will be stored for a newly launched cluster.
+                (OPTIONAL) tags_list (list): list of dictionary containing tags to be added to a newly launched cluster.
+                (OPTIONAL) ami_version (string): AMI version to be used. Same as for run_job.
+                (OPTIONAL) release_label (string): To be used for EMR 4 and above. Same as for run_job.
+                (OPTIONAL) max_clusters (int): maximum number of clusters in the pool. Default is 1.
+                (OPTIONAL) max_queue_depth (int): number of queued steps per cluster above which the pool is scaled up. Default is 1.
+                (OPTIONAL) idle_timeout (int): seconds after which an idle pool cluster terminates itself. Default is 3600.
+
+            OUTPUT: None. Sets job_id to the cluster used and step_ids to the ids of the submitted steps.
+
+            USAGE: conn_emr.run_job_in_pool('Pool Cluster','emr-logs/',release_label='emr-5.30.0',max_clusters=3)
+        '''
+        if len(self.instance_list) == 0:
+            raise ValueError("No instance configurations specified.")
+        if len(self.steps) == 0:
+            raise ValueError("No steps added to the job.")
+        if not release_label and not ami_version:
+            raise ValueError("Must specify either release label or ami version")
+        steps = [dict(step, ActionOnFailure="CONTINUE") for step in self.steps]
+        pool_key = self.get_pool_key(ami_version=ami_version, release_label=release_label)
+        clusters = self.get_pool_clusters(pool_key)
+        idle = [cluster for cluster in clusters if cluster["state"] == "WAITING" and cluster["queue_depth"] == 0]
+        busy = len(clusters) == 0 or min(cluster["queue_depth"] for cluster in clusters) >= max_queue_depth
+        if len(idle) != 0:
+            target = idle[0]["job_id"]
+        elif busy and len(clusters) < max_clusters:
+            target = None
+        else:
+            target = min(clusters, key=lambda x:x["queue_depth"])["job_id"]
+
+        if target:
+            self.job_id = target
+            self.step_ids = self.conn_emr.add_job_flow_steps(JobFlowId=target, Steps=steps)["StepIds"]
+            print("JobId is : " + self.job_id)
+        else:
+            job_steps = self.steps
+            self.steps = steps
+            try:
+                self.run_job(cluster_name + self._pool_name_suffix(pool_key), log_path, tags_list=(tags_list or []) + [{"Key":POOL_TAG, "Value":pool_key}],
+                             ami_version=ami_version, release_label=release_label, keep_alive=True, idle_timeout=idle_timeout)
+            finally:
+                self.steps = job_steps
+            self.step_ids = []
+            for page in self.conn_emr.get_paginator("list_steps").paginate(ClusterId=self.job_id):
+                self.step_ids.extend(step["Id"] for step in page["Steps"])
+
+    def scale_down_pool(self, pool_key, min_clusters=0):
+        '''
+            Function to terminate idle clusters of a cluster pool, keeping at least min_clusters clusters.
+
+            PARAMETERS:
+                pool_key (string): key of the pool, as returned by get_pool_key.
+                (OPTIONAL) min_clusters (int): number of clusters to keep in the pool. Default is 0.
+
+            OUTPUT:
+                A list of ids of the terminated clusters.
+
+            USAGE:
+                scale_down_pool(conn_emr.get_pool_key(release_label='emr-5.30.0'), min_clusters=1)
+        '''
+        clusters = self.get_pool_clusters(pool_key)
+        idle = [cluster["job_id"] for cluster in clusters if cluster["state"] == "WAITING" and cluster["queue_depth"] == 0]
+        terminate = idle[:max(0, len(clusters) - min_clusters)]
+        if len(terminate) != 0:
+            self.conn_emr.terminate_job_flows(JobFlowIds=terminate)
+        return terminate
+
+    def read_output(self, step=None, **kwargs):
+        '''
+            Function to read the records of a step's output, once the step has finished. Accepts the same optional
+            parameters as AwsS3Helper.iter_prefix_records.
+
+            PARAMETERS:
+                (OPTIONAL) step (string or int): name or index of a step added with add_job_step. Default is the last step added.
+
+            OUTPUT:
+                Yields records as strings, without line endings.
+
+            USAGE:
+                for record in read_output('My Step', merge=True):
+                    print(record)
+        '''
+        steps = [x for x in self.steps if "-output" in x["HadoopJarStep"]["Args"]]
+        if step is None:
+            step_dict = steps[-1] if len(steps) != 0 else None
+        elif isinstance(step, int):
+            step_dict = steps[step]
+        else:
+            step_dict = ([x for x in steps if x["Name"] == step] or [None])[0]
+        if step_dict is None:
+            raise ValueError("No such step added to the job.")
+        args = step_dict["HadoopJarStep"]["Args"]
+        output_path = args[args.index("-output") + 1]
+        return self.conn_s3.iter_prefix_records(output_path[len(self.s3n):], **kwargs)
+
+    def run_job_locally(self, local_root, num_workers=None, **kwargs):
+        '''
+            Function to run the steps added with add_job_step on this machine instead of EMR, e.g. on a sample of the
+            input to validate and profile a job before running it on a cluster. S3 paths are mapped to local paths
+            under local_root (bucket/key becomes local_root/bucket/key), so inputs should be copied there first, e.g.
+            with download_dir. Map tasks run over input splits and reduce tasks over partitions on a pool of
+            num_workers processes, with an external merge sort in between. See LocalJobRunner for other parameters.
+
+            PARAMETERS:
+                local_root (string): local directory standing in for S3.
+                (OPTIONAL) num_workers (int): number of processes. Default is the number of CPUs.
 
+            OUTPUT:
+                A list of dicts, one per step, with the number of map and reduce tasks, records and the seconds spent
+                in each phase.
 
+            USAGE:
+                conn_emr.run_job_locally('/home/xyz/s3_sample/')
+        '''
+        from local_runner import LocalJobRunner
+        runner = LocalJobRunner(local_root, num_workers=num_workers, **kwargs)
+        return [runner.run_step(step) for step in self.local_steps]
+
+def _cli_path(path):
+    '''
+        Utility function to tell s3 paths (s3://bucket/key) from local paths on the command line.
+
+        OUTPUT:
+            (path, is_s3), with the s3:// prefix removed from s3 paths.
+    '''
+    for scheme in ("s3://", "s3n://"):
+        if path.startswith(scheme):
+            return path[len(scheme):], True
+    return path, False
+
+def _cli_report(report):
+    '''
+        Utility function to print the report of a bulk operation and get the exit status of the command.
+    '''
+    sys.stdout.write("%d files, %d bytes in %.1fs (%.1f files/s, %.1f bytes/s), %d skipped, %d failed\n" % (
+        report["files"], report["bytes"], report["seconds"], report["files_per_sec"], report["bytes_per_sec"],
+        report["skipped"], len(report["failed"])))
+    for failed in report["failed"]:
+        sys.stderr.write("failed: %s: %s\n" % (failed["path"], failed["message"]))
+    return 1 if report["failed"] else 0
+
+def main(argv=None):
+    '''
+        Command line entry point, run as python -m boto3_utils, for one-shot operations from scripts and cron jobs.
+        Credentials are taken from AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY, or else from boto3's default chain.
+        Recursive operations run on a pool of --workers threads.
+
+        PARAMETERS:
+            (OPTIONAL) argv (list): command line arguments. Default is sys.argv[1:].
+
+        OUTPUT:
+            Exit status (int): 0 on success, 1 if some objects failed or a cluster terminated with errors.
+
+        USAGE:
+            python -m boto3_utils ls -r -l s3://s3_bucket/s3_path/
+            python -m boto3_utils cp -r /home/abc/local_dir/ s3://s3_bucket/s3_path/
+            python -m boto3_utils rm -r s3://s3_bucket/s3_path/
+            python -m boto3_utils sync s3://s3_bucket/s3_path/ /home/abc/local_dir/
+            python -m boto3_utils status --wait j-2EXXXXXXXXX
+    '''
+    import argparse
+    parser = argparse.ArgumentParser(prog="python -m boto3_utils", description="S3 and EMR utilities.")
+    parser.add_argument("--region", default=os.environ.get("AWS_DEFAULT_REGION", "ap-southeast-1"), help="AWS region")
+    parser.add_argument("--workers", type=int, default=10, help="number of objects processed in parallel")
+    commands = parser.add_subparsers(dest="command")
+    command = commands.add_parser("ls", help="list objects under a s3 path")
+    command.add_argument("path")
+    command.add_argument("-r", "--recursive", action="store_true", help="list all objects instead of one level")
+    command.add_argument("-l", "--long", action="store_true", help="show last modified time and size")
+    command.add_argument("--parallel", action="store_true", help="list sub-folders concurrently, with -r")
+    command = commands.add_parser("cp", help="copy files between local and s3 paths, or between s3 paths")
+    command.add_argument("src")
+    command.add_argument("dst")
+    command.add_argument("-r", "--recursive", action="store_true", help="copy everything under src")
+    command = commands.add_parser("rm", help="delete s3 objects")
+    command.add_argument("path")
+    command.add_argument("-r", "--recursive", action="store_true", help="delete everything under path as a folder")
+    command = commands.add_parser("sync", help="copy new and changed files between a local and a s3 path")
+    command.add_argument("src")
+    command.add_argument("dst")
+    command.add_argument("--etag", action="store_true", help="also compare contents of files of the same size")
+    command = commands.add_parser("status", help="show the state of EMR clusters")
+    command.add_argument("job_ids", nargs="+")
+    command.add_argument("--wait", action="store_true", help="wait for the clusters to terminate, showing transitions")
+    args = parser.parse_args(argv)
+    if not args.command:
+        parser.error("a command is required")
+
+    credentials = (os.environ.get("AWS_ACCESS_KEY_ID"), os.environ.get("AWS_SECRET_ACCESS_KEY"))
+    conn_s3 = AwsS3Helper(credentials[0], credentials[1], region_name=args.region, max_pool_connections=max(args.workers, 10))
+
+    if args.command == "ls":
+        path, _ = _cli_path(args.path)
+        bucket, key = conn_s3.set_key(path)
+        if args.recursive:
+            pages = (([entry], []) for entry in conn_s3.iter_keys(path, parallel=args.parallel, max_workers=args.workers))
+        else:
+            pages = conn_s3._list_pages(bucket, key, "/")
+        for entries, prefixes in pages:
+            for prefix in prefixes:
+                sys.stdout.write("%s%s\n" % ("%19s %12s " % ("", "PRE") if args.long else "", "s3://" + bucket + "/" + prefix))
+            for entry in entries:
+                if args.long:
+                    sys.stdout.write("%s %12d s3://%s\n" % (entry["last_modified"].strftime("%Y-%m-%d %H:%M:%S"), entry["size"], entry["path"]))
+                else:
+                    sys.stdout.write("s3://%s\n" % entry["path"])
+        return 0
+
+    if args.command == "rm":
+        path, is_s3 = _cli_path(args.path)
+        if not is_s3:
+            parser.error("rm takes a s3:// path")
+        if not args.recursive:
+            conn_s3.del_file(path)
+            return 0
+        # Delete only what is under path as a folder, so that rm -r s3://bucket/data leaves data-backup/ alone.
+        failed = conn_s3.delete_prefix(path.rstrip("/") + "/", max_workers=args.workers)
+        for entry in failed:
+            sys.stderr.write("failed: %s: %s\n" % (entry["path"], entry["message"]))
+        return 1 if failed else 0
+
+    if args.command == "status":
+        conn_emr = AwsEmrHelper(credentials[0], credentials[1], region_name=args.region)
+        if args.wait:
+            def show(event):
+                sys.stdout.write("%s\t%s\t%s\n" % (event["job_id"], event["name"], event["state"]))
+            states = conn_emr.wait_for_cluster(args.job_ids, callback=show)
+            return 1 if "TERMINATED_WITH_ERRORS" in states.values() else 0
+        describe = lambda job_id: conn_emr.conn_emr.describe_cluster(ClusterId=job_id)["Cluster"]["Status"]["State"]
+        states = dict((job_id, future.result()) for job_id, future in _bounded_imap(describe, args.job_ids, args.workers))
+        for job_id in args.job_ids:
+            sys.stdout.write("%s\t%s\n" % (job_id, states[job_id]))
+        return 1 if "TERMINATED_WITH_ERRORS" in states.values() else 0
+
+    src, src_s3 = _cli_path(args.src)
+    dst, dst_s3 = _cli_path(args.dst)
+    if not src_s3 and not dst_s3:
+        parser.error("one of src and dst must be a s3:// path")
+
+    if args.command == "sync":
+        if src_s3 and dst_s3:
+            parser.error("sync takes a local path and a s3:// path")
+        if src_s3:
+            report = conn_s3.sync(dst, src, direction="download", compare_etag=args.etag, max_workers=args.workers)
+        else:
+            report = conn_s3.sync(src, dst, direction="upload", compare_etag=args.etag, max_workers=args.workers)
+        return _cli_report(report)
+
+    if args.recursive:
+        if src_s3 and dst_s3:
+            report = conn_s3.copy_prefix(src, dst, max_workers=args.workers)
+        elif src_s3:
+            report = conn_s3.download_dir(src, dst, max_workers=args.workers)
+        else:
+            report = conn_s3.upload_dir(dst, src, max_workers=args.workers)
+        return _cli_report(report)
+
+    fname = src.rstrip("/").split("/")[-1] if src_s3 else os.path.basename(src)
+    if dst_s3 and (dst.endswith("/") or "/" not in dst):
+        dst = dst.rstrip("/") + "/" + fname
+    elif not dst_s3 and (os.path.isdir(dst) or dst.endswith(os.sep)):
+        dst = os.path.join(dst, fname)
+    if src_s3 and dst_s3:
+        conn_s3.copy_key(src, dst)
+    elif src_s3:
+        conn_s3.download_file(src, dst)
+    else:
+        conn_s3.upload_file(dst, src)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -41,12 +41,9 @@ def example_emr():
 
     conn_emr.add_instance(instance_config)
     conn_emr.run_job(cluster_name,'emr-logs/',release_label='emr-5.0.0')
-    jobstate = ''
-    while jobstate != 'TERMINATED':
-        jobstate = conn_emr.get_cluster_status()
-        if jobstate == 'TERMINATED_WITH_ERRORS': break
-        print jobstate
-        time.sleep(60)
+    def log_event(event):
+        print(event['name'] + ' : ' + event['state'])
+    conn_emr.wait_for_cluster(callback=log_event)     #returns when the cluster has terminated
 
 if __name__=="__main__":
     example_s3()
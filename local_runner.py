@@ -0,0 +1,371 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import time
+import zlib
+import bz2
+import gzip
+import heapq
+import errno
+import shutil
+import tempfile
+import threading
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+DEFAULT_SPLIT_SIZE = 64*1024*1024
+DEFAULT_SORT_BUFFER = 64*1024*1024
+
+def _local_path(local_root, path):
+    '''
+        Function to map an s3 path (bucket/key, optionally with the s3n:// or s3:// prefix) to its local path under
+        local_root.
+    '''
+    for scheme in ("s3n://", "s3://"):
+        if path.startswith(scheme):
+            path = path[len(scheme):]
+    return os.path.join(local_root, *[part for part in path.split("/") if part])
+
+def _input_files(path):
+    '''
+        Function to list the files of an input path, skipping the ones starting with '_' or '.' like Hadoop does
+        (e.g. _SUCCESS of a previous step).
+    '''
+    if os.path.isfile(path):
+        return [path]
+    if not os.path.isdir(path):
+        raise IOError("Input path %s does not exist." % path)
+    fnames = []
+    for root, dirs, files in os.walk(path):
+        dirs[:] = sorted(d for d in dirs if not d.startswith(("_", ".")))
+        fnames.extend(os.path.join(root, f) for f in sorted(files) if not f.startswith(("_", ".")))
+    return fnames
+
+def _splits(fname, split_size):
+    '''
+        Function to split an input file into (fname, start, end) byte ranges. Compressed files can't be split and
+        are read by a single map task.
+    '''
+    size = os.path.getsize(fname)
+    if fname.endswith((".gz", ".bz2")) or size == 0:
+        return [(fname, 0, size)]
+    return [(fname, start, min(start + split_size, size)) for start in range(0, size, split_size)]
+
+def _read_split(fname, start, end):
+    '''
+        Generator yielding the lines of a split. A line belongs to the split it starts in, so all but the first split
+        skip their first (partial) line and every split reads past end to finish its last one.
+    '''
+    compressed = fname.endswith((".gz", ".bz2"))
+    if fname.endswith(".gz"):
+        f = gzip.open(fname, "rb")
+    elif fname.endswith(".bz2"):
+        f = bz2.BZ2File(fname, "rb")
+    else:
+        f = open(fname, "rb")
+        if start > 0:
+            f.seek(start - 1)
+            start += len(f.readline()) - 1
+    with f:
+        pos = start
+        for line in iter(f.readline, b""):
+            if not compressed and pos >= end:
+                break
+            pos += len(line)
+            yield line
+
+def _record_key(line):
+    '''
+        Function to get the key of a record, i.e. the text before the first tab, or the whole line if it has none.
+    '''
+    return line.rstrip(b"\n").split(b"\t", 1)[0]
+
+def _iter_run(fname):
+    with open(fname, "rb") as f:
+        for line in f:
+            yield _record_key(line), line
+
+def _make_workdir(temp_dir, links):
+    '''
+        Function to create the working directory of a task, linking the mapper, reducer and cache files into it by
+        name like Hadoop's distributed cache does.
+    '''
+    workdir = tempfile.mkdtemp(prefix="task_", dir=temp_dir)
+    for name, src in links:
+        dst = os.path.join(workdir, name)
+        if hasattr(os, "symlink"):
+            os.symlink(os.path.abspath(src), dst)
+        elif os.path.isdir(src):
+            shutil.copytree(src, dst)
+        else:
+            shutil.copy(src, dst)
+    return workdir
+
+def _run_command(args, cwd, env, lines, write):
+    '''
+        Function to run a mapper or reducer, feeding it lines on stdin from a thread while its stdout is passed to
+        write line by line.
+    '''
+    proc = subprocess.Popen(args, cwd=cwd, env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    errors = []
+
+    def feed():
+        try:
+            for line in lines:
+                proc.stdin.write(line)
+        except (IOError, OSError) as e:
+            # The command may exit without reading all of its input; its exit status tells whether it failed.
+            if e.errno not in (errno.EPIPE, errno.EINVAL):
+                errors.append(e)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            try:
+                proc.stdin.close()
+            except (IOError, OSError):
+                pass
+
+    feeder = threading.Thread(target=feed)
+    feeder.daemon = True
+    feeder.start()
+    for line in iter(proc.stdout.readline, b""):
+        write(line)
+    proc.stdout.close()
+    proc.wait()
+    feeder.join()
+    if errors:
+        raise errors[0]
+    if proc.returncode != 0:
+        raise RuntimeError("'%s' exited with status %d." % (" ".join(args), proc.returncode))
+
+class _MapOutputBuffer:
+    '''
+        Buffer partitioning map output by key, spilling each partition's records sorted by key to a new run file
+        once more than sort_buffer bytes are held.
+    '''
+
+    def __init__(self, num_partitions, sort_buffer, prefix):
+        self.num_partitions = num_partitions
+        self.sort_buffer = sort_buffer
+        self.prefix = prefix
+        self.partitions = [[] for _ in range(num_partitions)]
+        self.runs = [[] for _ in range(num_partitions)]
+        self.size = 0
+        self.records = 0
+
+    def add(self, line):
+        if not line.endswith(b"\n"):
+            line += b"\n"
+        key = _record_key(line)
+        self.partitions[(zlib.crc32(key) & 0xffffffff) % self.num_partitions].append(line)
+        self.size += len(line)
+        self.records += 1
+        if self.size >= self.sort_buffer:
+            self.spill()
+
+    def spill(self):
+        for partition, lines in enumerate(self.partitions):
+            if not lines:
+                continue
+            fname = "%s-%05d-%03d" % (self.prefix, partition, len(self.runs[partition]))
+            with open(fname, "wb") as f:
+                f.writelines(sorted(lines, key=_record_key))
+            self.runs[partition].append(fname)
+            self.partitions[partition] = []
+        self.size = 0
+
+def _map_task(task):
+    '''
+        Function run in a worker process for each map task. With reducers, the mapper's output is partitioned and
+        sorted into run files; without, it is written to the task's part file.
+    '''
+    fname, start, end = task["split"]
+    workdir = _make_workdir(task["temp_dir"], task["links"])
+    env = dict(task["env"], map_input_file=fname, mapreduce_map_input_file=fname,
+               map_input_start=str(start), map_input_length=str(end - start))
+    records_in = [0]
+
+    def lines():
+        for line in _read_split(fname, start, end):
+            records_in[0] += 1
+            yield line
+
+    try:
+        if task["num_reducers"] == 0:
+            records_out = [0]
+            with open(task["output"], "wb") as out:
+                def write(line):
+                    records_out[0] += 1
+                    out.write(line)
+                _run_command(task["command"], workdir, env, lines(), write)
+            return {"records_in":records_in[0], "records_out":records_out[0], "runs":None}
+        output = _MapOutputBuffer(task["num_reducers"], task["sort_buffer"], task["output"])
+        _run_command(task["command"], workdir, env, lines(), output.add)
+        output.spill()
+        return {"records_in":records_in[0], "records_out":output.records, "runs":output.runs}
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def _reduce_task(task):
+    '''
+        Function run in a worker process for each reduce task, merging the sorted runs of its partition from every
+        map task into the reducer's stdin.
+    '''
+    workdir = _make_workdir(task["temp_dir"], task["links"])
+    records_in = [0]
+    records_out = [0]
+
+    def lines():
+        for _, line in heapq.merge(*[_iter_run(run) for run in task["runs"]]):
+            records_in[0] += 1
+            yield line
+
+    try:
+        with open(task["output"], "wb") as out:
+            def write(line):
+                records_out[0] += 1
+                out.write(line)
+            _run_command(task["command"], workdir, task["env"], lines(), write)
+        return {"records_in":records_in[0], "records_out":records_out[0]}
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+class LocalJobRunner:
+
+    def __init__(self, local_root, num_workers=None, num_reducers=None, split_size=DEFAULT_SPLIT_SIZE,
+                 sort_buffer=DEFAULT_SORT_BUFFER, python=None, temp_dir=None, overwrite=False):
+        '''
+            Runs Hadoop streaming steps on the local machine, standing in for an EMR cluster. Inputs are split in
+            split_size byte ranges aligned on lines, each split is piped through the mapper in its own process, and
+            map output is partitioned by key (the text before the first tab), sorted in memory up to sort_buffer
+            bytes per map task and spilled to disk. Each partition's sorted runs are then merged and piped through
+            the reducer, which writes one part file per partition to the step's output path, like Hadoop does.
+
+            PARAMETERS:
+                local_root (string): local directory standing in for S3; bucket/key is local_root/bucket/key.
+                (OPTIONAL) num_workers (int): number of map and reduce tasks run at a time. Default is the number of CPUs.
+                (OPTIONAL) num_reducers (int): number of reduce tasks of steps with a reducer, unless set in the step's additional_args with -numReduceTasks or -D mapreduce.job.reduces. Default is num_workers.
+                (OPTIONAL) split_size (int): size in bytes of the input splits. Default is 64MB.
+                (OPTIONAL) sort_buffer (int): bytes of map output held in memory by each map task before spilling to disk. Default is 64MB.
+                (OPTIONAL) python (string): python interpreter running mappers and reducers. Default is the current one.
+                (OPTIONAL) temp_dir (string): directory for the tasks' working directories and spilled runs. Default is the system's temporary directory.
+                (OPTIONAL) overwrite (bool): Flag to delete the local output path of a step if it exists. Default is set to False, failing like Hadoop does.
+
+            USAGE:
+                runner = LocalJobRunner('/home/xyz/s3_sample/', num_workers=4)
+                report = runner.run_step(conn_emr.local_steps[0])
+        '''
+        self.local_root = local_root
+        self.num_workers = num_workers or multiprocessing.cpu_count()
+        self.num_reducers = num_reducers
+        self.split_size = split_size
+        self.sort_buffer = sort_buffer
+        self.python = python or sys.executable
+        self.temp_dir = temp_dir
+        self.overwrite = overwrite
+
+    def _parse_args(self, additional_args):
+        '''
+            Function to get the number of reducers and the environment of the tasks from a step's additional
+            arguments. Arguments without a local equivalent are ignored.
+        '''
+        num_reducers = None
+        env = {}
+        args = iter(additional_args)
+        for arg in args:
+            if arg == "-numReduceTasks":
+                num_reducers = int(next(args))
+            elif arg == "-cmdenv":
+                name, _, value = next(args).partition("=")
+                env[name] = value
+            elif arg == "-D":
+                name, _, value = next(args).partition("=")
+                if name in ("mapreduce.job.reduces", "mapred.reduce.tasks"):
+                    num_reducers = int(value)
+        return num_reducers, env
+
+    def run_step(self, step):
+        '''
+            Function to run a step recorded by AwsEmrHelper.add_job_step.
+
+            PARAMETERS:
+                step (dict): entry of AwsEmrHelper.local_steps.
+
+            OUTPUT:
+                A dict with the number of map and reduce tasks, the records read and written in each phase, the
+                seconds spent in each phase and the local output path.
+
+            USAGE:
+                runner.run_step(conn_emr.local_steps[0])
+        '''
+        start = time.time()
+        output_dir = _local_path(self.local_root, step["output_path"])
+        if os.path.exists(output_dir):
+            if not self.overwrite:
+                raise IOError("Output path %s already exists." % output_dir)
+            shutil.rmtree(output_dir)
+
+        links = [(os.path.basename(step["mapper"]), step["mapper"])]
+        if step["reducer"]:
+            links.append((os.path.basename(step["reducer"]), step["reducer"]))
+        for path in step["cache_files"]:
+            if not step["local_cache_files"]:
+                path = _local_path(self.local_root, path)
+            links.append((os.path.basename(path), path))
+
+        num_reducers, cmdenv = self._parse_args(step["additional_args"])
+        if not step["reducer"]:
+            num_reducers = 0
+        elif num_reducers is None:
+            num_reducers = self.num_reducers or self.num_workers
+        env = dict(os.environ, **cmdenv)
+
+        splits = []
+        for path in step["input_path"]:
+            for fname in _input_files(_local_path(self.local_root, path)):
+                splits.extend(_splits(fname, self.split_size))
+
+        temp_dir = tempfile.mkdtemp(prefix="boto3_utils_local_", dir=self.temp_dir)
+        parts_dir = os.path.join(temp_dir, "output")
+        os.mkdir(parts_dir)
+        report = {"name":step["name"], "output_path":output_dir, "map_tasks":len(splits), "reduce_tasks":num_reducers}
+        try:
+            with ProcessPoolExecutor(max_workers=self.num_workers) as executor:
+                map_tasks = []
+                for i, split in enumerate(splits):
+                    if num_reducers == 0:
+                        output = os.path.join(parts_dir, "part-%05d" % i)
+                    else:
+                        output = os.path.join(temp_dir, "map-%05d" % i)
+                    map_tasks.append({"split":split, "links":links, "temp_dir":temp_dir, "env":env,
+                                      "command":[self.python, os.path.basename(step["mapper"])],
+                                      "num_reducers":num_reducers, "sort_buffer":self.sort_buffer, "output":output})
+                results = list(executor.map(_map_task, map_tasks))
+                report["map_input_records"] = sum(result["records_in"] for result in results)
+                report["map_output_records"] = sum(result["records_out"] for result in results)
+                report["map_seconds"] = round(time.time() - start, 3)
+
+                if num_reducers:
+                    reduce_start = time.time()
+                    reduce_tasks = [{"runs":[run for result in results for run in result["runs"][partition]],
+                                     "links":links, "temp_dir":temp_dir, "env":env,
+                                     "command":[self.python, os.path.basename(step["reducer"])],
+                                     "output":os.path.join(parts_dir, "part-%05d" % partition)}
+                                    for partition in range(num_reducers)]
+                    results = list(executor.map(_reduce_task, reduce_tasks))
+                    report["reduce_input_records"] = sum(result["records_in"] for result in results)
+                    report["reduce_output_records"] = sum(result["records_out"] for result in results)
+                    report["reduce_seconds"] = round(time.time() - reduce_start, 3)
+
+            # Output only appears once every task has succeeded.
+            parent = os.path.dirname(output_dir)
+            if parent and not os.path.isdir(parent):
+                os.makedirs(parent)
+            shutil.move(parts_dir, output_dir)
+            open(os.path.join(output_dir, "_SUCCESS"), "w").close()
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+        report["seconds"] = round(time.time() - start, 3)
+        return report